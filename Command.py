@@ -3,6 +3,9 @@ from enum import unique, Enum, auto
 
 @unique
 class Command(Enum):
+    def _generate_next_value_(name, start, count, last_values):
+        return name
+
     UP = auto()
     DOWN = auto()
     LEFT = auto()
@@ -13,6 +16,20 @@ class Command(Enum):
     OK = auto()
     DELETE = auto()
     DELETE_BEFORE = auto()
-
-    def _generate_next_value_(name, start, count, last_values):
-        return name
\ No newline at end of file
+    PAGE_UP = auto()
+    PAGE_DOWN = auto()
+    HOME = auto()
+    END = auto()
+    INSERT = auto()
+    F1 = auto()
+    F2 = auto()
+    F3 = auto()
+    F4 = auto()
+    F5 = auto()
+    F6 = auto()
+    F7 = auto()
+    F8 = auto()
+    F9 = auto()
+    F10 = auto()
+    F11 = auto()
+    F12 = auto()
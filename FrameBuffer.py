@@ -0,0 +1,148 @@
+from array import array
+from collections import namedtuple
+
+CSI = '\x1b['
+
+# the eight basic colours, which can be given by name
+COLORS = ['black', 'red', 'green', 'yellow', 'blue', 'magenta', 'cyan', 'white']
+
+Style = namedtuple('Style', ['fg', 'bg', 'bold', 'dim', 'italic', 'underline', 'reverse'],
+                   defaults=[None, None, False, False, False, False, False])
+Style.__doc__ = """
+How text is displayed.
+Colours are given by name (see COLORS), as a number of the 256 colour palette or as an (r, g, b) tuple.
+"""
+
+DEFAULT_STYLE = Style()
+
+
+def _color_params(color, base: int) -> str:
+    """Returns the SGR parameters of a foreground (base 30) or background (base 40) colour"""
+    if isinstance(color, str):
+        return str(base + COLORS.index(color.lower()))
+    if isinstance(color, tuple):
+        return '{};2;{};{};{}'.format(base + 8, *color)
+    if color < 8:
+        return str(base + color)
+    if color < 16:
+        # the bright colours
+        return str(base + 60 + color - 8)
+    return '{};5;{}'.format(base + 8, color)
+
+
+def sgr(style: Style) -> str:
+    """Returns the escape sequence that switches the terminal to the style"""
+    params = ['0']
+    if style.bold:
+        params.append('1')
+    if style.dim:
+        params.append('2')
+    if style.italic:
+        params.append('3')
+    if style.underline:
+        params.append('4')
+    if style.reverse:
+        params.append('7')
+    if style.fg is not None:
+        params.append(_color_params(style.fg, 30))
+    if style.bg is not None:
+        params.append(_color_params(style.bg, 40))
+    return CSI + ';'.join(params) + 'm'
+
+
+class StyleTable:
+    """
+    Interns styles, so that a frame stores a small number per cell instead of a Style.
+    The default style always has the id 0.
+    """
+
+    def __init__(self):
+        self.styles = []
+        self.ids = {}
+        # the escape sequence of each style
+        self.sequences = []
+        self._reversed = {}
+        self.id_of(DEFAULT_STYLE)
+
+    def id_of(self, style: Style) -> int:
+        style_id = self.ids.get(style)
+        if style_id is None:
+            style_id = len(self.styles)
+            if style_id > 0xffff:
+                raise Exception("too many different styles")
+            self.styles.append(style)
+            self.sequences.append(sgr(style))
+            self.ids[style] = style_id
+        return style_id
+
+    def reversed(self, style_id: int) -> int:
+        """Returns the id of the style with reversed foreground and background, e.g. to show the cursor"""
+        reversed_id = self._reversed.get(style_id)
+        if reversed_id is None:
+            style = self.styles[style_id]
+            reversed_id = self._reversed[style_id] = self.id_of(style._replace(reverse=not style.reverse))
+        return reversed_id
+
+
+# the styles of all frames, elements refer to styles by their id in this table
+STYLES = StyleTable()
+
+
+class FrameBuffer:
+    """
+    A grid of cells, each with a codepoint and the id of its style in a StyleTable.
+    The cells are stored row by row in two arrays.
+    """
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.chars = array('I', [ord(' ')]) * (width * height)
+        self.styles = array('H', [0]) * (width * height)
+
+    @classmethod
+    def from_rows(cls, rows: list, width: int, styles: array = None):
+        """
+        Creates a frame from rendered rows.
+        :param rows: The text of each row, rows of a different width are cut or padded
+        :param styles: The style id of each cell, the default style if not given
+        """
+        frame = cls.__new__(cls)
+        frame.width = width
+        frame.height = len(rows)
+        text = ''.join(rows)
+        if len(text) != width * len(rows):
+            text = ''.join(row[:width].ljust(width) for row in rows)
+        frame.chars = array('I')
+        frame.chars.frombytes(text.encode('utf-32-le', 'surrogatepass'))
+        if styles is None or len(styles) < len(frame.chars):
+            frame.styles = array('H', [0]) * len(frame.chars)
+        else:
+            frame.styles = styles[:len(frame.chars)]
+        return frame
+
+    def rows(self) -> list:
+        """Returns the text of each row"""
+        text = self.chars.tobytes().decode('utf-32-le', 'surrogatepass')
+        w = self.width
+        return [text[i:i + w] for i in range(0, w * self.height, w)]
+
+    def row_styles(self) -> list:
+        """Returns the style ids of each row"""
+        w = self.width
+        return [self.styles[i:i + w] for i in range(0, w * self.height, w)]
+
+    def put(self, x: int, y: int, text: str, style_id: int = None):
+        """Writes the text at the position, cut at the end of the row"""
+        text = text[:max(0, self.width - x)]
+        start = y * self.width + x
+        end = start + len(text)
+        self.chars[start:end] = array('I', text.encode('utf-32-le', 'surrogatepass'))
+        if style_id is not None:
+            self.styles[start:end] = array('H', [style_id]) * len(text)
+
+    def style_at(self, x: int, y: int) -> int:
+        return self.styles[y * self.width + x]
+
+    def set_style(self, x: int, y: int, style_id: int):
+        self.styles[y * self.width + x] = style_id
@@ -0,0 +1,128 @@
+# characters joined at once when searching, doubled for each further step
+FIND_CHUNK = 256
+
+
+class GapBuffer:
+    """
+    Text with an insertion point.
+    The characters are kept in a list with a gap at the insertion point,
+    so inserting and deleting at the point only copies the inserted text
+    and moving the point only copies the characters it moves across.
+    """
+
+    def __init__(self, text: str = '', capacity: int = 16):
+        self._chars = list(text) + [''] * capacity
+        self._gap_start = len(text)
+        self._gap_end = len(self._chars)
+        self._text = text
+
+    def __len__(self):
+        return len(self._chars) - (self._gap_end - self._gap_start)
+
+    def __str__(self):
+        # the text is cached until the next modification
+        if self._text is None:
+            self._text = ''.join(self._chars[:self._gap_start]) + ''.join(self._chars[self._gap_end:])
+        return self._text
+
+    def slice(self, start: int, end: int) -> str:
+        """Returns the text from start to end, only these characters are joined"""
+        n = len(self)
+        start = max(0, min(start, n))
+        end = max(start, min(end, n))
+        if self._text is not None:
+            return self._text[start:end]
+        chars = self._chars
+        gap_start = self._gap_start
+        gap = self._gap_end - gap_start
+        if end <= gap_start:
+            return ''.join(chars[start:end])
+        if start >= gap_start:
+            return ''.join(chars[start + gap:end + gap])
+        return ''.join(chars[start:gap_start]) + ''.join(chars[self._gap_end:end + gap])
+
+    def find(self, sub: str, start: int = 0) -> int:
+        """Like str.find, but only the text up to the match is joined"""
+        n = len(self)
+        chunk = FIND_CHUNK
+        while start < n:
+            i = self.slice(start, start + chunk + len(sub) - 1).find(sub)
+            if i >= 0:
+                return start + i
+            start += chunk
+            chunk *= 2
+        return -1
+
+    def rfind(self, sub: str, end: int = None) -> int:
+        """Like str.rfind with the text up to end, but only the text back to the match is joined"""
+        end = len(self) if end is None else max(0, min(end, len(self)))
+        chunk = FIND_CHUNK
+        while True:
+            lo = max(0, end - chunk)
+            i = self.slice(lo, end).rfind(sub)
+            if i >= 0:
+                return lo + i
+            if lo == 0:
+                return -1
+            # a match may overlap the start of the searched part
+            end = lo + len(sub) - 1
+            chunk *= 2
+
+    @property
+    def point(self) -> int:
+        """The index at which text is inserted"""
+        return self._gap_start
+
+    def move_to(self, index: int):
+        """Moves the insertion point to the index, which is clamped to the text"""
+        index = max(0, min(index, len(self)))
+        chars = self._chars
+        if index < self._gap_start:
+            n = self._gap_start - index
+            chars[self._gap_end - n:self._gap_end] = chars[index:self._gap_start]
+            self._gap_start = index
+            self._gap_end -= n
+        elif index > self._gap_start:
+            n = index - self._gap_start
+            chars[self._gap_start:self._gap_start + n] = chars[self._gap_end:self._gap_end + n]
+            self._gap_start += n
+            self._gap_end += n
+
+    def _grow(self, needed: int):
+        # at least double the size so that growing is amortized O(1) per character
+        extra = max(needed, len(self._chars))
+        self._chars[self._gap_end:self._gap_end] = [''] * extra
+        self._gap_end += extra
+
+    def insert(self, text: str):
+        """Inserts the text at the insertion point and moves the point after it"""
+        n = len(text)
+        if n == 0:
+            return
+        if self._gap_end - self._gap_start < n:
+            self._grow(n)
+        self._chars[self._gap_start:self._gap_start + n] = text
+        self._gap_start += n
+        self._text = None
+
+    def delete_before(self, n: int = 1) -> str:
+        """Deletes up to n characters before the insertion point and returns them"""
+        n = min(n, self._gap_start)
+        deleted = ''.join(self._chars[self._gap_start - n:self._gap_start])
+        self._gap_start -= n
+        if n:
+            self._text = None
+        return deleted
+
+    def delete_after(self, n: int = 1) -> str:
+        """Deletes up to n characters after the insertion point and returns them"""
+        n = min(n, len(self._chars) - self._gap_end)
+        deleted = ''.join(self._chars[self._gap_end:self._gap_end + n])
+        self._gap_end += n
+        if n:
+            self._text = None
+        return deleted
+
+    def set_text(self, text: str):
+        """Replaces the whole text and moves the insertion point to its end"""
+        self.__init__(text)
@@ -0,0 +1,205 @@
+import os
+import sys
+import time
+import threading
+
+# maximum number of bytes taken from the terminal in a single read
+READ_SIZE = 4096
+
+BRACKETED_PASTE_ON = '\x1b[?2004h'
+BRACKETED_PASTE_OFF = '\x1b[?2004l'
+
+
+class InputBackend:
+    """
+    Reads raw user input from the terminal.
+    A backend is used as a context manager around the main loop
+    so that it can put the terminal into the mode it needs and restore it afterwards.
+    """
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def read(self, timeout_millis: int = 0) -> bytes:
+        """
+        Waits for user input and returns all bytes that are available.
+        :param timeout_millis: How long to wait at most, wait indefinitely if not positive
+        :return: The input or None if the timeout passed or the wait was interrupted by wake() or a resize
+        """
+        raise NotImplementedError
+
+    def read_available(self) -> bytes:
+        """Returns the input that is available right now without waiting, or None if there is none"""
+        return None
+
+    def wake(self):
+        """Makes a pending or the next call of read() return early. May be called from any thread."""
+        raise NotImplementedError
+
+    def attach(self, event_loop, callback) -> bool:
+        """
+        Lets an asyncio event loop watch for input instead of calling read().
+        :param event_loop: The event loop to register with
+        :param callback: Called on the event loop with the input, or with None after a resize or wake()
+        :return: False if this backend cannot be watched by an event loop
+        """
+        return False
+
+    def detach(self, event_loop):
+        pass
+
+
+class WindowsInputBackend(InputBackend):
+    """Reads input from the Windows console via msvcrt"""
+
+    def __init__(self):
+        import msvcrt
+        self.msvcrt = msvcrt
+        self._woken = threading.Event()
+
+    def read(self, timeout_millis: int = 0) -> bytes:
+        msvcrt = self.msvcrt
+        start_time = time.perf_counter()
+        while not msvcrt.kbhit():
+            if self._woken.is_set():
+                self._woken.clear()
+                return None
+            if 0 < timeout_millis < (time.perf_counter() - start_time) * 1000:
+                return None
+            time.sleep(0.001)
+        data = msvcrt.getch()
+        while msvcrt.kbhit() and len(data) < READ_SIZE:
+            data += msvcrt.getch()
+        return data
+
+    def read_available(self) -> bytes:
+        if not self.msvcrt.kbhit():
+            return None
+        return self.read()
+
+    def wake(self):
+        self._woken.set()
+
+
+class PosixInputBackend(InputBackend):
+    """
+    Reads input from a POSIX terminal.
+    While open, the terminal is in raw mode and stdin is waited on with a selector,
+    so waiting for input costs no CPU time. A SIGWINCH handler wakes up pending reads
+    when the terminal is resized.
+    """
+
+    def __init__(self, fd: int = None):
+        import selectors
+        self.fd = sys.stdin.fileno() if fd is None else fd
+        self._saved_attrs = None
+        self._saved_sigwinch = None
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.fd, selectors.EVENT_READ, 'input')
+        self.selector.register(self._wake_r, selectors.EVENT_READ, 'wake')
+
+    def open(self):
+        import termios
+        import signal
+        if os.isatty(self.fd):
+            self._saved_attrs = termios.tcgetattr(self.fd)
+            attrs = termios.tcgetattr(self.fd)
+            # like cfmakeraw, but output processing stays on so that newlines still work
+            attrs[0] &= ~(termios.BRKINT | termios.ICRNL | termios.INPCK | termios.ISTRIP | termios.IXON)
+            attrs[2] |= termios.CS8
+            attrs[3] &= ~(termios.ECHO | termios.ICANON | termios.IEXTEN | termios.ISIG)
+            attrs[6][termios.VMIN] = 1
+            attrs[6][termios.VTIME] = 0
+            termios.tcsetattr(self.fd, termios.TCSAFLUSH, attrs)
+            # pasted text is sent between ESC [ 200 ~ and ESC [ 201 ~
+            sys.stdout.write(BRACKETED_PASTE_ON)
+            sys.stdout.flush()
+        if threading.current_thread() is threading.main_thread():
+            self._saved_sigwinch = signal.signal(signal.SIGWINCH, lambda signum, frame: self.wake())
+
+    def close(self):
+        import termios
+        import signal
+        if self._saved_attrs is not None:
+            sys.stdout.write(BRACKETED_PASTE_OFF)
+            sys.stdout.flush()
+            termios.tcsetattr(self.fd, termios.TCSAFLUSH, self._saved_attrs)
+            self._saved_attrs = None
+        if self._saved_sigwinch is not None:
+            signal.signal(signal.SIGWINCH, self._saved_sigwinch)
+            self._saved_sigwinch = None
+
+    def read(self, timeout_millis: int = 0) -> bytes:
+        timeout = timeout_millis / 1000 if timeout_millis > 0 else None
+        data = None
+        for key, _ in self.selector.select(timeout):
+            if key.data == 'wake':
+                self._drain_wake_pipe()
+            else:
+                data = os.read(self.fd, READ_SIZE)
+                if not data:
+                    raise EOFError("end of input")
+        return data
+
+    def read_available(self) -> bytes:
+        for key, _ in self.selector.select(0):
+            if key.data == 'input':
+                data = os.read(self.fd, READ_SIZE)
+                if not data:
+                    raise EOFError("end of input")
+                return data
+        return None
+
+    def wake(self):
+        try:
+            os.write(self._wake_w, b'\0')
+        except BlockingIOError:
+            # the pipe is full, the reader will wake up anyway
+            pass
+
+    def attach(self, event_loop, callback) -> bool:
+        def on_input():
+            data = os.read(self.fd, READ_SIZE)
+            if not data:
+                raise EOFError("end of input")
+            callback(data)
+
+        def on_wake():
+            self._drain_wake_pipe()
+            callback(None)
+
+        event_loop.add_reader(self.fd, on_input)
+        event_loop.add_reader(self._wake_r, on_wake)
+        return True
+
+    def detach(self, event_loop):
+        event_loop.remove_reader(self.fd)
+        event_loop.remove_reader(self._wake_r)
+
+    def _drain_wake_pipe(self):
+        try:
+            while os.read(self._wake_r, READ_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+
+
+def default_backend() -> InputBackend:
+    """Returns the input backend for the current platform"""
+    if os.name == 'nt':
+        return WindowsInputBackend()
+    return PosixInputBackend()
@@ -1,44 +1,323 @@
+import os
+import time
+from collections import deque, namedtuple
+
 from Command import Command
 
+# seconds to wait for the rest of an escape sequence before a lone ESC counts as Command.BACK
+ESC_TIMEOUT = 0.05
+# consumed bytes are only removed from the buffer once there are this many
+COMPACT_THRESHOLD = 4096
+
+# modifier flags of Modified
+SHIFT = 1
+ALT = 2
+CTRL = 4
+
+Modified = namedtuple('Modified', ['key', 'modifiers'])
+Modified.__doc__ = """A character or Command that was entered together with modifier keys"""
+
+
+class Paste(str):
+    """Text that was pasted as a whole, see bracketed paste mode"""
+    pass
+
+
+# ends the text of a bracketed paste, which starts with ESC [ 200 ~
+PASTE_END = b'\x1b[201~'
+
+CONTROL_CHARS = {
+    0x09: Command.NEXT,
+    0x0a: Command.OK,
+    0x0d: Command.OK,
+    0x08: Command.DELETE_BEFORE,
+    0x7f: Command.DELETE_BEFORE,
+    0x1b: Command.BACK,
+}
+
+PRINTABLE_COMMANDS = {
+    '`': Command.SWITCH,
+}
+
+# CSI sequences identified by their final byte, e.g. ESC [ A or ESC [ 1 ; 5 A
+# SS3 sequences, e.g. ESC O A, use the same table
+CSI_FINAL = {
+    ord('A'): Command.UP,
+    ord('B'): Command.DOWN,
+    ord('C'): Command.RIGHT,
+    ord('D'): Command.LEFT,
+    ord('H'): Command.HOME,
+    ord('F'): Command.END,
+    ord('P'): Command.F1,
+    ord('Q'): Command.F2,
+    ord('R'): Command.F3,
+    ord('S'): Command.F4,
+}
+
+# CSI sequences ending with ~ identified by their first parameter, e.g. ESC [ 5 ~
+CSI_TILDE = {
+    1: Command.HOME,
+    2: Command.INSERT,
+    3: Command.DELETE,
+    4: Command.END,
+    5: Command.PAGE_UP,
+    6: Command.PAGE_DOWN,
+    7: Command.HOME,
+    8: Command.END,
+    11: Command.F1,
+    12: Command.F2,
+    13: Command.F3,
+    14: Command.F4,
+    15: Command.F5,
+    17: Command.F6,
+    18: Command.F7,
+    19: Command.F8,
+    20: Command.F9,
+    21: Command.F10,
+    23: Command.F11,
+    24: Command.F12,
+}
+
+# second byte after a \xe0 or \x00 prefix in the Windows console
+WINDOWS_SCAN_CODES = {
+    ord('H'): Command.UP,
+    ord('P'): Command.DOWN,
+    ord('M'): Command.RIGHT,
+    ord('K'): Command.LEFT,
+    ord('S'): Command.DELETE,
+    ord('R'): Command.INSERT,
+    ord('I'): Command.PAGE_UP,
+    ord('Q'): Command.PAGE_DOWN,
+    ord('G'): Command.HOME,
+    ord('O'): Command.END,
+    0x3b: Command.F1,
+    0x3c: Command.F2,
+    0x3d: Command.F3,
+    0x3e: Command.F4,
+    0x3f: Command.F5,
+    0x40: Command.F6,
+    0x41: Command.F7,
+    0x42: Command.F8,
+    0x43: Command.F9,
+    0x44: Command.F10,
+    0x85: Command.F11,
+    0x86: Command.F12,
+}
+
+# returned by _decode if the buffer ends in the middle of a sequence
+_INCOMPLETE = object()
+# returned by _decode if the buffer ends in the middle of a paste, which never times out
+_INCOMPLETE_PASTE = object()
+
 
 class InputParser:
-    def __init__(self):
-        self.queue = b''
+    """
+    Decodes raw input into characters (str), Commands and Modified keys.
+    Input is appended to a bytearray and consumed by moving a read cursor,
+    so decoding a large paste is a single linear pass.
+    ANSI CSI and SS3 sequences are decoded by a small state machine and
+    sequences that are split across reads are completed by later pushes.
+    A lone ESC is only reported as Command.BACK once no further bytes
+    arrived within esc_timeout, otherwise ESC and the next key are Alt+key.
+    Text pasted in bracketed paste mode is reported as a single Paste.
+    While get() yields an input, timestamp is the time at which its first byte was pushed.
+    """
+
+    def __init__(self, windows_scan_codes: bool = os.name == 'nt', esc_timeout: float = ESC_TIMEOUT):
+        self.buffer = bytearray()
+        self.pos = 0
+        self.windows_scan_codes = windows_scan_codes
+        self.esc_timeout = esc_timeout
+        # when an incomplete sequence at the end of the buffer was first seen
+        self._incomplete_since = None
+        # how far the buffer was searched for the end of an incomplete paste
+        self._paste_scanned = None
+        # (offset after the chunk, timestamp) of the pushed chunks that are not fully decoded,
+        # offsets count from the start of the input, of which _removed bytes were compacted away
+        self._chunks = deque()
+        self._removed = 0
+        self.timestamp = None
+        # returns the current time for the escape timeout, a replay puts the time of the recording here
+        self.clock = time.monotonic
+
+    def push(self, key: bytes, timestamp: float = None):
+        """
+        Appends raw input to the buffer.
+        :param timestamp: When the input was read, as returned by time.perf_counter(), defaults to now
+        """
+        if self.pos >= COMPACT_THRESHOLD and self.pos * 2 >= len(self.buffer):
+            del self.buffer[:self.pos]
+            self._removed += self.pos
+            if self._paste_scanned is not None:
+                self._paste_scanned -= self.pos
+            self.pos = 0
+        if key:
+            self.buffer += key
+            self._chunks.append((self._removed + len(self.buffer),
+                                 time.perf_counter() if timestamp is None else timestamp))
+
+    def _timestamp_at(self, pos: int) -> float:
+        offset = self._removed + pos
+        chunks = self._chunks
+        while chunks and chunks[0][0] <= offset:
+            chunks.popleft()
+        return chunks[0][1] if chunks else None
 
-    def push(self, key):
-        self.queue += key
+    def pending(self) -> bool:
+        """Whether there is input that is not decoded yet"""
+        return self.pos < len(self.buffer)
+
+    def pending_timeout(self):
+        """Returns the seconds until pending input is decoded even if it is incomplete, or None"""
+        if not self.pending() or self._paste_scanned is not None:
+            return None
+        if self._incomplete_since is None:
+            return 0
+        return max(0.0, self._incomplete_since + self.esc_timeout - self.clock())
 
     def get(self):
-        while len(self.queue) > 0:
-            fst = self.queue[:1]
-            if 32 <= fst[0] <= 126:
-                yield fst.decode()
-            if fst == b'\x03':
-                raise KeyboardInterrupt
-            if fst == b'\x1b':
-                yield Command.BACK
-            if fst == b'\r':
-                yield Command.OK
-            if fst == b'`':
-                yield Command.SWITCH
-            if fst == b'\t':
-                yield Command.NEXT
-            if fst == b'\x08':
-                yield Command.DELETE_BEFORE
-            if fst == b'\xe0':
-                if len(self.queue) < 2:
+        buf = self.buffer
+        while self.pos < len(buf):
+            result, end = self._decode(buf, self.pos)
+            if result is _INCOMPLETE_PASTE:
+                return
+            if result is _INCOMPLETE:
+                now = self.clock()
+                if self._incomplete_since is None:
+                    self._incomplete_since = now
+                if now - self._incomplete_since < self.esc_timeout:
                     return
-                snd = self.queue[1:2]
-                if snd == b'P':
-                    yield Command.DOWN
-                if snd == b'H':
-                    yield Command.UP
-                if snd == b'M':
-                    yield Command.RIGHT
-                if snd == b'K':
-                    yield Command.LEFT
-                if snd == b'S':
-                    yield Command.DELETE
-                self.queue = self.queue[2:]
-                continue
-            self.queue = self.queue[1:]
+                # give up waiting
+                result, end = self._decode_timed_out(buf, self.pos)
+            start = self.pos
+            self.pos = end
+            self._incomplete_since = None
+            if result is not None:
+                self.timestamp = self._timestamp_at(start)
+                yield result
+
+    def _decode(self, buf, i):
+        """Decodes the input starting at buf[i]. Returns the result (or None to skip) and the index after it"""
+        b = buf[i]
+        if 32 <= b <= 126:
+            c = chr(b)
+            return PRINTABLE_COMMANDS.get(c, c), i + 1
+        if b == 0x1b:
+            return self._decode_escape(buf, i)
+        if self.windows_scan_codes and b in (0xe0, 0x00):
+            if i + 1 >= len(buf):
+                return _INCOMPLETE, i
+            return WINDOWS_SCAN_CODES.get(buf[i + 1]), i + 2
+        if b >= 0xc0:
+            return self._decode_utf8(buf, i)
+        return self._decode_single(buf, i)
+
+    def _decode_timed_out(self, buf, i):
+        """Decodes the incomplete input starting at buf[i], which reaches up to the end of the buffer"""
+        if buf[i] == 0x1b and i + 1 < len(buf) and buf[i + 1:] != b'\x1b':
+            # the start of an escape sequence whose rest was delayed, e.g. by a slow connection,
+            # it is dropped as only a lone ESC means Command.BACK
+            return None, len(buf)
+        # the first byte stands for itself
+        return self._decode_single(buf, i)
+
+    def _decode_single(self, buf, i):
+        b = buf[i]
+        if b == 0x03:
+            self.pos = i + 1
+            raise KeyboardInterrupt
+        if b in CONTROL_CHARS:
+            return CONTROL_CHARS[b], i + 1
+        if 1 <= b <= 26:
+            return Modified(chr(b + 96), CTRL), i + 1
+        return None, i + 1
+
+    def _decode_utf8(self, buf, i):
+        b = buf[i]
+        length = 2 if b < 0xe0 else 3 if b < 0xf0 else 4
+        if i + length > len(buf):
+            return _INCOMPLETE, i
+        try:
+            return bytes(buf[i:i + length]).decode(), i + length
+        except UnicodeDecodeError:
+            return None, i + 1
+
+    def _decode_escape(self, buf, i):
+        n = len(buf)
+        if i + 1 >= n:
+            return _INCOMPLETE, i
+        intro = buf[i + 1]
+        if intro == ord('['):
+            return self._decode_csi(buf, i + 2)
+        if intro == ord('O'):
+            if i + 2 >= n:
+                return _INCOMPLETE, i
+            return CSI_FINAL.get(buf[i + 2]), i + 3
+        if intro == 0x1b:
+            if i + 2 >= n:
+                return _INCOMPLETE, i
+            if buf[i + 2] not in (ord('['), ord('O')):
+                # ESC pressed twice
+                return Command.BACK, i + 1
+            # some terminals send Alt with a special key as ESC before its sequence
+            key, end = self._decode_escape(buf, i + 1)
+            if key is _INCOMPLETE:
+                return _INCOMPLETE, i
+            if key is None:
+                return None, end
+            if isinstance(key, Modified):
+                return Modified(key.key, key.modifiers | ALT), end
+            return Modified(key, ALT), end
+        key, end = self._decode(buf, i + 1)
+        if key is _INCOMPLETE:
+            return _INCOMPLETE, i
+        if key is None:
+            return None, end
+        return Modified(key, ALT), end
+
+    def _decode_csi(self, buf, j):
+        """Decodes the parameters and the final byte of a CSI sequence starting at buf[j]"""
+        n = len(buf)
+        params = []
+        param = None
+        while j < n:
+            b = buf[j]
+            if 0x30 <= b <= 0x39:
+                param = (param or 0) * 10 + b - 0x30
+            elif b == 0x3b:
+                params.append(param)
+                param = None
+            elif 0x40 <= b <= 0x7e:
+                params.append(param)
+                return self._csi_result(buf, params, b, j + 1)
+            elif not 0x20 <= b <= 0x3f:
+                # not a valid sequence, drop what we have seen so far
+                return None, j
+            j += 1
+        return _INCOMPLETE, None
+
+    def _csi_result(self, buf, params, final, end):
+        if final == ord('~'):
+            if params[0] == 200:
+                return self._decode_paste(buf, end)
+            key = CSI_TILDE.get(params[0])
+        else:
+            key = CSI_FINAL.get(final)
+        if key is None:
+            return None, end
+        modifiers = params[1] if len(params) > 1 and params[1] else 1
+        if modifiers > 1:
+            return Modified(key, modifiers - 1), end
+        return key, end
+
+    def _decode_paste(self, buf, start):
+        """Decodes the pasted text starting at buf[start] up to the end marker"""
+        scanned = start if self._paste_scanned is None else self._paste_scanned
+        end = buf.find(PASTE_END, scanned)
+        if end < 0:
+            # the end marker may already have arrived partially
+            self._paste_scanned = max(start, len(buf) - len(PASTE_END) + 1)
+            return _INCOMPLETE_PASTE, None
+        self._paste_scanned = None
+        text = bytes(buf[start:end]).decode(errors='replace')
+        return Paste(text.replace('\r\n', '\n').replace('\r', '\n')), end + len(PASTE_END)
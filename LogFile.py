@@ -0,0 +1,230 @@
+import os
+import mmap
+from array import array
+from operator import add
+from itertools import accumulate, chain
+from collections import OrderedDict
+
+# lines indexed at once when scrolling back beyond the indexed lines
+INDEX_CHUNK = 1024
+# bytes searched for line starts at once
+INDEX_BYTES = 1 << 20
+# decoded lines that are kept
+CACHED_LINES = 4096
+
+
+class LogFile:
+    """
+    The lines of a growing text file as a sequence, e.g. as the source of a ListView.
+    The file is memory-mapped and only the start offsets of its last lines are indexed,
+    earlier lines are indexed backwards when they are asked for with index_backwards,
+    so even files of many gigabytes are opened right away.
+    index_head indexes lines from the start of the file on, the lines between them
+    and the last lines stay unindexed until one of both reaches the other, see gap.
+    Only a bounded number of decoded lines is kept.
+    update() indexes appended lines and starts over when the file was truncated or replaced,
+    e.g. by log rotation.
+    """
+
+    def __init__(self, path: str, encoding: str = 'utf-8', cached_lines: int = CACHED_LINES):
+        self.path = path
+        self.encoding = encoding
+        self.cached_lines = cached_lines
+        self.file = None
+        self.map = None
+        # (device, inode) of the opened file, a different one at the path means the file was replaced
+        self._identity = None
+        # the offset at which each indexed line starts, the indexed lines reach up to the end of the file
+        self.starts = array('q')
+        # the starts of the lines indexed from the start of the file on, only while there is a gap, see gap
+        self.head = array('q')
+        # where the first line after the head starts
+        self._head_end = 0
+        # the size of the file when it was last indexed
+        self.end = 0
+        # (start, end) -> decoded line, the most recently used last
+        self._lines = OrderedDict()
+        self.update()
+
+    def __len__(self):
+        """The number of indexed lines"""
+        return len(self.head) + len(self.starts)
+
+    def gap(self) -> int:
+        """Returns the index of the first line after the lines that are not indexed, None if the indexed lines are contiguous"""
+        return len(self.head) if self.head else None
+
+    def __getitem__(self, i: int) -> str:
+        head = self.head
+        starts = self.starts
+        if i < 0:
+            i += len(self)
+        if 0 <= i < len(head):
+            start = head[i]
+            end = (head[i + 1] if i + 1 < len(head) else self._head_end) - 1
+            return self._line(start, end)
+        i -= len(head)
+        if not 0 <= i < len(starts):
+            raise IndexError("line {} is not indexed".format(i))
+        start = starts[i]
+        end = starts[i + 1] - 1 if i + 1 < len(starts) else self.end
+        return self._line(start, end)
+
+    def _line(self, start: int, end: int) -> str:
+        key = (start, end)
+        lines = self._lines
+        line = lines.get(key)
+        if line is not None:
+            lines.move_to_end(key)
+            return line
+        data = self.map[start:end]
+        if data.endswith(b'\n'):
+            # the last line is complete
+            data = data[:-1]
+        if data.endswith(b'\r'):
+            data = data[:-1]
+        line = lines[key] = data.decode(self.encoding, 'replace')
+        if len(lines) > self.cached_lines:
+            lines.popitem(last=False)
+        return line
+
+    def update(self) -> bool:
+        """
+        Indexes the lines that were appended since the last update.
+        If the file was truncated or replaced, it is opened and indexed again.
+        :return: Whether the lines changed
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            # e.g. rotated away and not created again yet, the old lines stay
+            return False
+        if self.file is None or (stat.st_dev, stat.st_ino) != self._identity or stat.st_size < self.end:
+            self._open()
+            return True
+        if stat.st_size == self.end:
+            return False
+        old_end = self.end
+        self._map()
+        self._index_forward(old_end)
+        return True
+
+    def _open(self):
+        self.close()
+        self.file = open(self.path, 'rb')
+        stat = os.fstat(self.file.fileno())
+        self._identity = (stat.st_dev, stat.st_ino)
+        self.starts = array('q')
+        self.head = array('q')
+        self._head_end = 0
+        self._lines.clear()
+        self.end = 0
+        self._map()
+        self.index_backwards(INDEX_CHUNK)
+
+    def _map(self):
+        """Maps the file as it is now, the end of the file becomes the new end"""
+        size = os.fstat(self.file.fileno()).st_size
+        if self.map is not None:
+            self.map.close()
+        # an empty file cannot be mapped
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.end = size
+
+    def _line_starts(self, lo: int, hi: int) -> array:
+        """Returns the offsets after each newline between lo and hi, where lines start"""
+        pieces = self.map[lo:hi].split(b'\n')
+        # the k-th line after lo starts after the lengths of the k lines before it and their newlines
+        return array('q', map(add, accumulate(map(len, pieces[:-1])), range(lo + 1, lo + len(pieces))))
+
+    def _index_forward(self, pos: int):
+        """Indexes the lines that start at or after pos, which is the end of the indexed lines"""
+        end = self.end
+        starts = self.starts
+        if not starts:
+            self.index_backwards(INDEX_CHUNK)
+            return
+        if self.map[pos - 1] == ord('\n'):
+            # the last indexed line was complete, so a new line starts at pos
+            starts.append(pos)
+        for lo in range(pos, end, INDEX_BYTES):
+            starts.extend(self._line_starts(lo, min(end, lo + INDEX_BYTES)))
+        if starts[-1] == end:
+            # the file ends with a newline
+            starts.pop()
+
+    def index_backwards(self, n: int = None) -> int:
+        """
+        Indexes up to n lines before the first indexed line.
+        :param n: The number of lines, None for all lines up to the start of the file or the head
+        :return: The number of lines that were indexed, by which the index of each indexed line grew
+        """
+        # lines before the first line after the head are indexed already
+        floor = self._head_end
+        if self.map is None or (self.starts and self.starts[0] == floor):
+            return 0
+        # the newline that ends the line before the first indexed line is not searched
+        hi = (self.starts[0] if self.starts else self.end) - 1
+        found = []
+        count = 0
+        while n is None or count < n:
+            lo = max(floor, hi - INDEX_BYTES)
+            starts = self._line_starts(lo, hi)
+            if lo == floor:
+                starts.insert(0, floor)
+            if n is not None and count + len(starts) > n:
+                starts = starts[len(starts) - (n - count):]
+            found.append(starts)
+            count += len(starts)
+            if lo == floor:
+                break
+            # the line that contains lo starts before it
+            hi = starts[0] - 1 if starts else lo
+        found.reverse()
+        self.starts = array('q', chain.from_iterable(found)) + self.starts
+        if self.head and self.starts[0] == floor:
+            self._join()
+        return count
+
+    def index_head(self, n: int = INDEX_CHUNK) -> int:
+        """
+        Indexes up to n lines from the start of the file on, after the lines indexed this way before.
+        Only the bytes of these lines are searched, however large the file is.
+        :return: The number of lines that were indexed, by which the index of each line after the gap grew
+        """
+        if self.map is None or not self.starts:
+            return 0
+        limit = self.starts[0]
+        if limit == self._head_end:
+            # the lines are contiguous already
+            return 0
+        # the next line starts where the head ends
+        found = array('q', [self._head_end])
+        lo = self._head_end
+        while len(found) <= n and lo < limit:
+            hi = min(limit, lo + INDEX_BYTES)
+            found.extend(self._line_starts(lo, hi))
+            lo = hi
+        if found[-1] == limit and len(found) - 1 <= n:
+            # reached the last lines
+            found.pop()
+            self.head.extend(found)
+            self._join()
+            return len(found)
+        self.head.extend(found[:n])
+        self._head_end = found[n]
+        return n
+
+    def _join(self):
+        """Makes the head part of the indexed lines once nothing is missing between them"""
+        self.starts = self.head + self.starts
+        self.head = array('q')
+        self._head_end = 0
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
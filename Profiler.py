@@ -0,0 +1,219 @@
+import os
+import json
+import math
+import time
+import threading
+from array import array
+from collections import deque
+
+# number of frames whose statistics are kept
+PROFILE_FRAMES = 120
+# number of spans kept for the Chrome trace
+MAX_TRACE_EVENTS = 100000
+
+# category of the spans that cover a whole phase of a frame
+PHASE = 'phase'
+
+# range and resolution of the buckets of a Histogram
+HISTOGRAM_MIN = 1e-6
+HISTOGRAM_MAX = 100.0
+BUCKETS_PER_DOUBLING = 4
+
+
+class Profiler:
+    """
+    Records how long each frame and each element takes.
+    Spans are opened with begin and closed with end, they may be nested.
+    For phases of a frame (update, render, write) the whole duration is recorded,
+    for elements only the time not spent in nested spans, so a container
+    is not blamed for the time its children take.
+    The statistics of the last frames are kept per element name and category,
+    all spans can be exported as a Chrome trace (chrome://tracing, Perfetto).
+    """
+
+    def __init__(self, frames: int = PROFILE_FRAMES, max_events: int = MAX_TRACE_EVENTS):
+        self.frames = deque(maxlen=frames)
+        self.events = deque(maxlen=max_events)
+        self.frame = 0
+        self._current = None
+        # open spans: [category, name, start, time spent in nested spans]
+        self._stack = []
+        self._origin = time.perf_counter()
+
+    def _frame_stats(self) -> dict:
+        if self._current is None:
+            self.frame += 1
+            self._current = {'frame': self.frame, 'start': time.perf_counter() - self._origin,
+                             'phases': {}, 'elements': {}}
+        return self._current
+
+    def begin_frame(self):
+        self.end_frame()
+        self._frame_stats()
+
+    def end_frame(self, drawn: bool = True):
+        """
+        Stores the statistics of the current frame.
+        :param drawn: If False, the frame is only kept if an element was fetched, flowed or rendered
+        """
+        stats = self._current
+        self._current = None
+        if stats is not None and (drawn or stats['elements']):
+            self.frames.append(stats)
+
+    def begin(self, category: str, name: str):
+        self._stack.append([category, name, time.perf_counter(), 0.0])
+
+    def end(self):
+        end = time.perf_counter()
+        category, name, start, nested = self._stack.pop()
+        duration = end - start
+        if self._stack:
+            self._stack[-1][3] += duration
+        stats = self._frame_stats()
+        if category == PHASE:
+            phases = stats['phases']
+            phases[name] = phases.get(name, 0.0) + duration
+        else:
+            times = stats['elements'].setdefault(name, {})
+            times[category] = times.get(category, 0.0) + duration - nested
+        self.events.append((category, name, start - self._origin, duration, stats['frame']))
+
+    def measure(self, category: str, name: str):
+        """Returns a context manager that records the enclosed code as a span"""
+        return _Span(self, category, name)
+
+    def phase_averages(self) -> dict:
+        """Returns the average seconds per frame of each phase"""
+        totals = {}
+        for stats in self.frames:
+            for name, seconds in stats['phases'].items():
+                totals[name] = totals.get(name, 0.0) + seconds
+        n = max(1, len(self.frames))
+        return {name: seconds / n for name, seconds in totals.items()}
+
+    def element_averages(self) -> dict:
+        """Returns the average seconds per frame of each element name and category"""
+        totals = {}
+        for stats in self.frames:
+            for name, times in stats['elements'].items():
+                elem_totals = totals.setdefault(name, {})
+                for category, seconds in times.items():
+                    elem_totals[category] = elem_totals.get(category, 0.0) + seconds
+        n = max(1, len(self.frames))
+        return {name: {category: seconds / n for category, seconds in times.items()}
+                for name, times in totals.items()}
+
+    def top(self, n: int = 5) -> list:
+        """
+        Returns the n elements that took the most time per frame on average.
+        :return: A list of (name, seconds, {category: seconds}), slowest first
+        """
+        averages = [(name, sum(times.values()), times) for name, times in self.element_averages().items()]
+        averages.sort(key=lambda entry: entry[1], reverse=True)
+        return averages[:n]
+
+    def trace(self) -> dict:
+        """Returns the recorded spans in the Chrome trace event format"""
+        pid = os.getpid()
+        tid = threading.get_ident()
+        return {'traceEvents': [{'name': name, 'cat': category, 'ph': 'X',
+                                 'ts': start * 1e6, 'dur': duration * 1e6,
+                                 'pid': pid, 'tid': tid, 'args': {'frame': frame}}
+                                for category, name, start, duration, frame in self.events],
+                'displayTimeUnit': 'ms'}
+
+    def export_trace(self, path: str):
+        """Writes the recorded spans to a file that can be loaded in chrome://tracing"""
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f)
+
+    def export_json(self, path: str):
+        """Writes the statistics of the kept frames and their averages to a JSON file"""
+        with open(path, 'w') as f:
+            json.dump({'frames': list(self.frames),
+                       'phases': self.phase_averages(),
+                       'elements': self.element_averages()}, f, indent=2)
+
+    def clear(self):
+        self.frames.clear()
+        self.events.clear()
+        self._current = None
+
+
+class _Span:
+    def __init__(self, profiler: Profiler, category: str, name: str):
+        self.profiler = profiler
+        self.category = category
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.begin(self.category, self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler.end()
+        return False
+
+
+class Histogram:
+    """
+    Counts durations in buckets whose bounds grow exponentially,
+    so the memory used is fixed no matter how many values are added
+    and percentiles are accurate to about 20% of the value.
+    """
+
+    def __init__(self, min_value: float = HISTOGRAM_MIN, max_value: float = HISTOGRAM_MAX,
+                 buckets_per_doubling: int = BUCKETS_PER_DOUBLING):
+        self.min_value = min_value
+        self._scale = buckets_per_doubling / math.log(2)
+        # bucket 0 counts values up to min_value, bucket i values up to min_value * 2 ** (i / buckets_per_doubling)
+        self.counts = array('Q', [0]) * (math.ceil(math.log(max_value / min_value) * self._scale) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float):
+        if value <= self.min_value:
+            i = 0
+        else:
+            i = min(len(self.counts) - 1, math.ceil(math.log(value / self.min_value) * self._scale))
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def upper_bound(self, i: int) -> float:
+        """The largest value counted in bucket i"""
+        return self.min_value * math.exp(i / self._scale)
+
+    def percentile(self, p: float) -> float:
+        """
+        Returns an upper bound of the value below which p percent of the values lie.
+        :return: The bound, never more than the largest value, or 0 if no values were added
+        """
+        if self.count == 0:
+            return 0.0
+        rank = math.ceil(self.count * p / 100) or 1
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.upper_bound(i), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def clear(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def __str__(self):
+        return 'n={} p50={:.1f}ms p99={:.1f}ms max={:.1f}ms'.format(
+            self.count, self.percentile(50) * 1000, self.percentile(99) * 1000, self.max * 1000)
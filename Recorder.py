@@ -0,0 +1,270 @@
+import json
+import time
+import argparse
+import importlib
+
+from ticlif import Controller, TerminationRequestedException
+from Terminal import VirtualTerminal
+
+# start of every recording, the last byte is the version of the format
+MAGIC = b'TCLR\x01'
+
+# kinds of records
+# raw input as it was read, followed by its length and the bytes
+INPUT = 1
+# the controller handled the input received so far, see Controller.process_user_input
+HANDLING = 2
+# the window size changed, followed by the width and the height
+SIZE = 3
+
+
+def _write_varint(out: bytearray, n: int):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple:
+    n = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+class Recorder:
+    """
+    Records the input and window sizes a controller receives into a compact binary log:
+    each record is its kind, the microseconds since the previous record and its data,
+    all numbers as variable-length integers. A key press takes about five bytes.
+    Recording starts when the recorder is set as Controller.recorder.
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self._last = None
+        self._buffer = bytearray()
+
+    def _begin(self, kind: int, timestamp: float = None):
+        now = time.perf_counter() if timestamp is None else timestamp
+        if self._last is None:
+            self._last = now
+        # input may be handled in a different order than it was read
+        micros = max(0, int((now - self._last) * 1e6))
+        self._last += micros / 1e6
+        self._buffer.append(kind)
+        _write_varint(self._buffer, micros)
+
+    def record_input(self, data: bytes, timestamp: float = None):
+        """
+        :param timestamp: When the input was read, as returned by time.perf_counter(), defaults to now
+        """
+        self._begin(INPUT, timestamp)
+        _write_varint(self._buffer, len(data))
+        self._buffer += data
+
+    def record_handling(self):
+        self._begin(HANDLING)
+        # written once per batch of input, so a crash loses as little as possible
+        self.flush()
+
+    def record_size(self, width: int, height: int):
+        self._begin(SIZE)
+        _write_varint(self._buffer, width)
+        _write_varint(self._buffer, height)
+
+    def flush(self):
+        self.file.write(self._buffer)
+        self._buffer.clear()
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+def read_records(path: str) -> list:
+    """
+    Reads a log written by a Recorder.
+    :return: A list of (seconds since the first record, kind, data), where data is the input
+             of INPUT records, (width, height) for SIZE records and None for HANDLING records
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise Exception("{} is not a recording of this version".format(path))
+    records = []
+    pos = len(MAGIC)
+    micros = 0
+    while pos < len(data):
+        kind = data[pos]
+        delta, pos = _read_varint(data, pos + 1)
+        micros += delta
+        if kind == INPUT:
+            length, pos = _read_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif kind == SIZE:
+            width, pos = _read_varint(data, pos)
+            height, pos = _read_varint(data, pos)
+            value = (width, height)
+        elif kind == HANDLING:
+            value = None
+        else:
+            raise Exception("unknown record kind {} at byte {}".format(kind, pos))
+        records.append((micros / 1e6, kind, value))
+    return records
+
+
+def _summary(seconds: list) -> dict:
+    """Returns statistics of the durations in milliseconds"""
+    if not seconds:
+        return {'mean': 0.0, 'median': 0.0, 'p95': 0.0, 'max': 0.0}
+    samples = sorted(seconds)
+    return {'mean': sum(samples) / len(samples) * 1000,
+            'median': samples[len(samples) // 2] * 1000,
+            'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+            'max': samples[-1] * 1000}
+
+
+class Replayer:
+    """
+    Replays a recording on a headless controller with a VirtualTerminal and measures every frame.
+    The controller runs on the clock of the recording, so escape sequences, frame rate limits
+    and refresh intervals behave as they did while recording, whether the replay waits for
+    the original timing or runs as fast as possible.
+    """
+
+    def __init__(self, path: str, root, realtime: bool = False):
+        """
+        :param root: The root to replay the input on, usually created the same way as while recording
+        :param realtime: Whether to wait between records as long as while recording
+        """
+        self.records = read_records(path)
+        self.root = root
+        self.realtime = realtime
+        size = next((value for _, kind, value in self.records if kind == SIZE), (80, 24))
+        self.terminal = VirtualTerminal(*size)
+        self.controller = Controller(self.terminal)
+        self.controller.clock = self.clock
+        self.controller.input_parser.clock = self.clock
+        # the time of the recording the replay is at
+        self.now = 0.0
+        self._started = None
+        # (time of the recording, seconds spent) of each drawn frame and of each handled batch of input
+        self.frames = []
+        self.handling = []
+
+    def clock(self) -> float:
+        return self.now
+
+    def _advance(self, t: float):
+        """Moves the clock of the recording to t, waiting for it in a realtime replay"""
+        self.now = max(self.now, t)
+        if self.realtime:
+            wait = self._started + self.now - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+
+    def _frame(self) -> float:
+        """Draws a frame like the main loop and returns the seconds until a postponed frame is due, or None"""
+        ctl = self.controller
+        writes = self.terminal.writes
+        start = time.perf_counter()
+        wait = ctl.next_frame()
+        seconds = time.perf_counter() - start
+        if self.terminal.writes != writes:
+            self.frames.append((self.now, seconds))
+        return wait
+
+    def _run_until(self, t: float, frame_wait: float) -> float:
+        """Draws the frames and refreshes the main loop would have done before the time t"""
+        ctl = self.controller
+        while True:
+            deadlines = [] if frame_wait is None else [self.now + frame_wait]
+            schedule = ctl._schedule()
+            if schedule is not None and schedule.heap:
+                deadlines.append(schedule.next_deadline())
+            # background fetches that time out make their content stale
+            deadlines.extend(elem._fetch_started + elem.fetch_timeout for elem in ctl._fetching if not elem._stale)
+            if not deadlines or min(deadlines) > t:
+                return frame_wait
+            self._advance(min(deadlines))
+            ctl.refresh_if_due()
+            frame_wait = self._frame()
+
+    def run(self) -> dict:
+        """
+        Replays all records, or until the recorded input ended the loop.
+        :return: A summary of the frame and input handling times in milliseconds
+        """
+        ctl = self.controller
+        ctl.active_root = self.root
+        self._started = time.perf_counter()
+        frame_wait = self._frame()
+        for t, kind, value in self.records:
+            frame_wait = self._run_until(t, frame_wait)
+            self._advance(t)
+            if kind == INPUT:
+                ctl.receive_input(value, time.perf_counter())
+                continue
+            if kind == SIZE:
+                self.terminal.resize(*value)
+            elif kind == HANDLING:
+                start = time.perf_counter()
+                try:
+                    ctl.process_user_input()
+                except TerminationRequestedException:
+                    break
+                finally:
+                    self.handling.append((self.now, time.perf_counter() - start))
+            frame_wait = self._frame()
+        else:
+            if frame_wait is not None:
+                # the frame rate limit postponed the frame of the last input
+                self._run_until(self.now + frame_wait, frame_wait)
+        return self.report()
+
+    def report(self) -> dict:
+        slowest = sorted(self.frames, key=lambda frame: frame[1], reverse=True)[:5]
+        return {'records': len(self.records),
+                'recorded_seconds': self.records[-1][0] if self.records else 0.0,
+                'replay_seconds': time.perf_counter() - self._started if self._started else 0.0,
+                'frames': len(self.frames),
+                'frame_ms': _summary([seconds for _, seconds in self.frames]),
+                'input_handling_ms': _summary([seconds for _, seconds in self.handling]),
+                'slowest_frames': [{'at': t, 'ms': seconds * 1000} for t, seconds in slowest]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a recorded session and prints the frame times as JSON")
+    parser.add_argument('recording')
+    parser.add_argument('app', help="module:function that returns the root to replay the input on")
+    parser.add_argument('--realtime', action='store_true', help="wait between inputs as long as while recording")
+    parser.add_argument('--output', help="also write the result to this file")
+    args = parser.parse_args()
+
+    module_name, _, function_name = args.app.partition(':')
+    root = getattr(importlib.import_module(module_name), function_name)()
+    output = json.dumps(Replayer(args.recording, root, realtime=args.realtime).run(), indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
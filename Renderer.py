@@ -0,0 +1,241 @@
+import os
+import sys
+
+from FrameBuffer import FrameBuffer, StyleTable, STYLES
+
+CSI = '\x1b['
+CLEAR_SCREEN = CSI + 'H' + CSI + '2J'
+HIDE_CURSOR = CSI + '?25l'
+SHOW_CURSOR = CSI + '?25h'
+RESET_STYLE = CSI + '0m'
+
+# unchanged characters between two changed runs that are cheaper to
+# rewrite than to jump over with a new cursor positioning sequence
+MERGE_GAP = 6
+
+
+def move_to(x: int, y: int) -> str:
+    """Returns the sequence that moves the terminal cursor to column x and row y (both 0-based)"""
+    return CSI + str(y + 1) + ';' + str(x + 1) + 'H'
+
+
+def changed_runs(old: str, new: str, old_styles=None, new_styles=None):
+    """
+    Yields (start, end) slices of new that differ from old.
+    Both strings must have the same length.
+    If styles are given, cells whose style changed differ as well.
+    Runs separated by no more than MERGE_GAP equal characters are merged.
+    """
+    if old_styles is None:
+        # only the characters are compared
+        old_styles = new_styles = old
+    n = len(new)
+    i = 0
+    while i < n:
+        if old[i] == new[i] and old_styles[i] == new_styles[i]:
+            i += 1
+            continue
+        start = i
+        end = i + 1
+        gap = 0
+        i += 1
+        while i < n:
+            if old[i] != new[i] or old_styles[i] != new_styles[i]:
+                end = i + 1
+                gap = 0
+            else:
+                gap += 1
+                if gap > MERGE_GAP:
+                    break
+            i += 1
+        yield start, end
+
+
+class Renderer:
+    """
+    Writes frames to the terminal.
+    The last frame is kept and each new frame is compared with it
+    so that only the changed runs of each row are written,
+    positioned with ANSI cursor sequences and sent in a single write.
+    Within a run, the style is only switched where it changes.
+    The cursor is drawn over the frame by reversing the style of its cell.
+    """
+
+    def __init__(self, out=None, styles: StyleTable = None):
+        self.out = out or sys.stdout
+        self.styles = styles or STYLES
+        # the text and the style ids of each row of the last frame
+        self.last_frame = None
+        self.last_styles = None
+        # the FrameBuffer drawn last and the position of the cursor on it
+        self.frame = None
+        self.cursor = None
+        # the style the terminal is in, None if unknown
+        self.style = None
+        # renderers drawing the same frames can share a dict here, so that
+        # the difference between two frames is only computed by one of them
+        self.shared = None
+        self.bytes_written = 0
+        # whether the terminal cursor was shown again by suspend
+        self.suspended = False
+        if os.name == 'nt':
+            # enables processing of ANSI sequences in the Windows console
+            os.system('')
+
+    def invalidate(self):
+        """Forgets the last frame so that the next frame is written in full"""
+        self.last_frame = None
+        self.last_styles = None
+        self.frame = None
+        self.cursor = None
+        self.style = None
+
+    def _append_styled(self, parts: list, text: str, styles, start: int, end: int):
+        """Appends text[start:end] to parts, switching the style once per run of cells with the same style"""
+        sequences = self.styles.sequences
+        current = self.style
+        if end - start == len(styles) and styles.count(styles[0]) == end - start:
+            # the whole row has a single style
+            if styles[0] != current:
+                parts.append(sequences[styles[0]])
+                self.style = styles[0]
+            parts.append(text)
+            return
+        i = start
+        while i < end:
+            style = styles[i]
+            j = i + 1
+            while j < end and styles[j] == style:
+                j += 1
+            if style != current:
+                parts.append(sequences[style])
+                current = style
+            parts.append(text[i:j])
+            i = j
+        self.style = current
+
+    def diff(self, frame, cursor=None) -> str:
+        """
+        Returns the string that turns the last frame into the given frame on screen.
+        :param frame: The new frame, a FrameBuffer or a list of rows
+        :param cursor: The (x, y) position of the cursor or None to show no cursor
+        :return: The escape sequences and text to write
+        """
+        return ''.join(self._diff(frame, cursor))
+
+    def _diff(self, frame, cursor) -> tuple:
+        """
+        Returns the changes of the frame and the changes of the cursor separately, see diff.
+        If the renderer is shared, the changes of the frame are the same string for all renderers that get them.
+        """
+        if not isinstance(frame, FrameBuffer):
+            frame = FrameBuffer.from_rows(frame, max((len(row) for row in frame), default=0))
+        last = self.last_frame
+        last_styles = self.last_styles
+        shared = self.shared
+        if shared is None:
+            changes = self._changes(frame)
+        else:
+            key = (self.frame, frame, self.style)
+            entry = shared.get(key)
+            if entry is None:
+                changes = self._changes(frame)
+                shared[key] = (changes, self.last_frame, self.last_styles, self.style)
+            else:
+                changes, self.last_frame, self.last_styles, self.style = entry
+        self.frame = frame
+        old_cursor = self.cursor
+        self.cursor = cursor
+        if not changes and cursor == old_cursor:
+            return changes, ''
+        parts = []
+        rows = self.last_frame
+        row_styles = self.last_styles
+        if old_cursor is not None and old_cursor != cursor:
+            # the cell under the old cursor gets its own style back
+            x, y = old_cursor
+            if 0 <= y < len(rows) and 0 <= x < len(rows[y]):
+                parts.append(move_to(x, y))
+                self._append_styled(parts, rows[y], row_styles[y], x, x + 1)
+        if cursor is not None:
+            x, y = cursor
+            # the cursor only has to be drawn again if it moved or its row was written
+            redraw = (cursor != old_cursor or last is None or len(last) != len(rows)
+                     or last[y] != rows[y] or last_styles[y] != row_styles[y])
+            if redraw and 0 <= y < len(rows) and 0 <= x < len(rows[y]):
+                style = self.styles.reversed(row_styles[y][x])
+                parts.append(move_to(x, y))
+                if style != self.style:
+                    parts.append(self.styles.sequences[style])
+                    self.style = style
+                parts.append(rows[y][x])
+        return changes, ''.join(parts)
+
+    def _changes(self, frame) -> str:
+        """Returns the string that turns the last frame without the cursor into the given frame"""
+        rows = frame.rows()
+        row_styles = frame.row_styles()
+        last = self.last_frame
+        last_styles = self.last_styles
+        self.last_frame = rows
+        self.last_styles = row_styles
+
+        if last is None or len(last) != len(rows):
+            parts = [HIDE_CURSOR, RESET_STYLE, CLEAR_SCREEN]
+            self.style = 0
+            for y, row in enumerate(rows):
+                parts.append(move_to(0, y))
+                self._append_styled(parts, row, row_styles[y], 0, len(row))
+            return ''.join(parts)
+
+        parts = []
+        for y, (old, new) in enumerate(zip(last, rows)):
+            old_styles = last_styles[y]
+            new_styles = row_styles[y]
+            same_styles = old_styles == new_styles
+            if old == new and same_styles:
+                continue
+            if len(old) != len(new):
+                parts.append(move_to(0, y))
+                parts.append(RESET_STYLE)
+                self.style = 0
+                parts.append(CSI + '2K')
+                self._append_styled(parts, new, new_styles, 0, len(new))
+                continue
+            runs = changed_runs(old, new) if same_styles else changed_runs(old, new, old_styles, new_styles)
+            for start, end in runs:
+                parts.append(move_to(start, y))
+                self._append_styled(parts, new, new_styles, start, end)
+        return ''.join(parts)
+
+    def draw(self, frame, cursor=None):
+        """Writes the frame, a FrameBuffer or a list of rows, with the cursor at the given position"""
+        changes, cursor_changes = self._diff(frame, cursor)
+        if changes or cursor_changes:
+            if self.suspended:
+                self.out.write(HIDE_CURSOR)
+                self.bytes_written += len(HIDE_CURSOR)
+                self.suspended = False
+            # written separately, so the output can tell the changes shared with other renderers apart
+            if changes:
+                self.out.write(changes)
+            if cursor_changes:
+                self.out.write(cursor_changes)
+            self.out.flush()
+            self.bytes_written += len(changes) + len(cursor_changes)
+
+    def suspend(self):
+        """
+        Restores the terminal cursor and moves it below the last frame like close,
+        but keeps the last frame, so that the next frame only writes what changed
+        """
+        height = len(self.last_frame) if self.last_frame else 0
+        self.out.write(RESET_STYLE + move_to(0, height) + SHOW_CURSOR + '\n')
+        self.out.flush()
+        self.style = 0
+        self.suspended = True
+
+    def close(self):
+        """Restores the terminal cursor and moves it below the last frame"""
+        self.suspend()
+        self.invalidate()
@@ -0,0 +1,553 @@
+import time
+import zlib
+import socket
+import struct
+import selectors
+import threading
+
+import InputBackend
+from ticlif import Controller, ScreenMap, RefreshSchedule, TerminationRequestedException, MAX_FPS
+from Renderer import RESET_STYLE, SHOW_CURSOR
+from Terminal import Terminal, ConsoleTerminal, QueueInputBackend
+
+# every message starts with its kind and the length of its payload
+HEADER = struct.Struct('!BI')
+# viewer -> server: raw input
+INPUT = 1
+# viewer -> server: the window size as SIZE_FORMAT
+SIZE = 2
+# server -> viewer: zlib compressed output
+OUTPUT = 3
+SIZE_FORMAT = struct.Struct('!HH')
+# larger window sizes sent by a viewer are reduced to these
+MAX_WIDTH = 1000
+MAX_HEIGHT = 1000
+# a viewer sending a longer message is disconnected
+MAX_MESSAGE_SIZE = 1 << 20
+
+# maximum number of bytes taken from a socket in a single read
+READ_SIZE = 65536
+# zlib level of the output, frames are small so speed matters more than ratio
+COMPRESSION_LEVEL = 6
+# how often a Viewer checks whether its window was resized, in milliseconds
+RESIZE_POLL_MILLIS = 100
+
+
+def encode_message(kind: int, payload: bytes = b'') -> bytes:
+    return HEADER.pack(kind, len(payload)) + payload
+
+
+def decode_messages(buffer: bytearray):
+    """
+    Yields the (kind, payload) of each complete message in the buffer and removes them from it.
+    An incomplete message at the end stays in the buffer.
+    """
+    pos = 0
+    while len(buffer) - pos >= HEADER.size:
+        kind, length = HEADER.unpack_from(buffer, pos)
+        end = pos + HEADER.size + length
+        if len(buffer) < end:
+            break
+        yield kind, bytes(buffer[pos + HEADER.size:end])
+        pos = end
+    del buffer[:pos]
+
+
+def create_socket(address, listen: bool = False) -> socket.socket:
+    """
+    Creates a Unix socket if the address is a path and a TCP socket if it is a (host, port) tuple.
+    :param listen: Whether to bind to the address and listen on it instead of connecting to it
+    """
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    if listen:
+        if family == socket.AF_INET:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+        sock.listen()
+    else:
+        sock.connect(address)
+    return sock
+
+
+class ClientTerminal(Terminal):
+    """
+    The terminal of a viewer as seen by the server.
+    Its size is the one the viewer sent last, each write is compressed on its own
+    and queued for sending when the Renderer flushes the frame.
+    Writes of the same string to several viewers are only compressed once, see Server.compress.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        # unknown until the viewer sends its size
+        self.size = None
+        self._input_backend = QueueInputBackend()
+        self._parts = []
+
+    @property
+    def input_backend(self) -> InputBackend.InputBackend:
+        return self._input_backend
+
+    def window_size(self) -> tuple:
+        return self.size or (0, 0)
+
+    def write(self, s: str):
+        self._parts.append(s)
+
+    def flush(self):
+        if not self._parts:
+            return
+        server = self.connection.server
+        data = b''.join(encode_message(OUTPUT, server.compress(part)) for part in self._parts)
+        self._parts.clear()
+        self.connection.send(data)
+
+
+class ClientController(Controller):
+    """
+    The controller of a single viewer: its cursor, window size, active root and renderer.
+    Background content functions and async content run on the controller of the server,
+    so they are shared by all viewers.
+    """
+
+    def __init__(self, server, terminal: Terminal):
+        super(ClientController, self).__init__(terminal)
+        self.server = server
+        self._fetching = server.controller._fetching
+
+    def submit(self, fn, *args, callback=None):
+        return self.server.controller.submit(fn, *args, callback=callback)
+
+    def spawn(self, awaitable, callback=None, errback=None):
+        return self.server.controller.spawn(awaitable, callback, errback)
+
+    def request_redraw(self):
+        self.server.controller.request_redraw()
+
+    def collect_background_results(self):
+        # done once per frame for all viewers, see Server.update
+        pass
+
+
+class Connection:
+    """A viewer connected to a Server"""
+
+    def __init__(self, server, sock: socket.socket):
+        self.server = server
+        self.sock = sock
+        self.terminal = ClientTerminal(self)
+        self.controller = ClientController(server, self.terminal)
+        self._received = bytearray()
+        # bytes that could not be sent yet
+        self._unsent = bytearray()
+        # whether the viewer may see something different than in its last frame
+        self.stale = True
+        self.closed = False
+
+    def send(self, data: bytes):
+        if self.closed:
+            return
+        if not self._unsent:
+            try:
+                data = data[self.sock.send(data):]
+            except BlockingIOError:
+                pass
+            except OSError:
+                self.server.close_connection(self)
+                return
+        if data:
+            self._unsent += data
+            self.server.watch(self)
+
+    def sending(self) -> bool:
+        """Whether bytes are still waiting to be sent"""
+        return bool(self._unsent)
+
+    def send_unsent(self):
+        try:
+            del self._unsent[:self.sock.send(self._unsent)]
+        except BlockingIOError:
+            return
+        except OSError:
+            self.server.close_connection(self)
+            return
+        if not self._unsent:
+            self.server.watch(self)
+
+    def receive(self) -> bool:
+        """
+        Reads the available messages, queues the input and applies the window size.
+        :return: Whether input was received
+        """
+        try:
+            data = self.sock.recv(READ_SIZE)
+        except BlockingIOError:
+            return False
+        except OSError:
+            data = b''
+        if not data:
+            self.server.close_connection(self)
+            return False
+        self._received += data
+        has_input = False
+        read_time = time.perf_counter()
+        for kind, payload in decode_messages(self._received):
+            if kind == INPUT:
+                self.controller.receive_input(payload, read_time)
+                has_input = True
+            elif kind == SIZE and len(payload) == SIZE_FORMAT.size:
+                width, height = SIZE_FORMAT.unpack(payload)
+                self.terminal.size = (min(width, MAX_WIDTH), min(height, MAX_HEIGHT))
+                self.stale = True
+            else:
+                # not a viewer, only this connection is closed
+                self.server.close_connection(self)
+                return False
+        if len(self._received) > MAX_MESSAGE_SIZE:
+            self.server.close_connection(self)
+            return False
+        return has_input
+
+
+class _Waker(InputBackend.InputBackend):
+    """Wakes up the server loop when a background fetch completed, see Controller.request_redraw"""
+
+    def __init__(self):
+        self.reader, self.writer = socket.socketpair()
+        self.reader.setblocking(False)
+        self.writer.setblocking(False)
+
+    def read(self, timeout_millis: int = 0) -> bytes:
+        return None
+
+    def wake(self):
+        try:
+            self.writer.send(b'\0')
+        except BlockingIOError:
+            # a wake-up is already pending
+            pass
+
+    def drain(self):
+        try:
+            while self.reader.recv(READ_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+
+
+class Server:
+    """
+    Serves the roots to any number of viewers over Unix or TCP sockets.
+    Each viewer has its own cursor, window size and active root and receives
+    the zlib compressed differences between its frames.
+    Content is fetched once per frame for all viewers, and viewers of the same root
+    with the same window size are drawn one after another so that the root is only
+    laid out and rendered once for all of them.
+    """
+
+    def __init__(self, address=None, max_fps: int = MAX_FPS, compression_level: int = COMPRESSION_LEVEL):
+        """
+        :param address: A path for a Unix socket or a (host, port) tuple for TCP, see listen
+        :param max_fps: The maximum number of frames per second of each viewer
+        """
+        self.max_fps = max_fps
+        self.compression_level = compression_level
+        # runs the background content functions and async content of all viewers
+        self.controller = Controller()
+        self.waker = _Waker()
+        self.controller.input_backend = self.waker
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.waker.reader, selectors.EVENT_READ)
+        self.listeners = []
+        self.connections = []
+        self.roots = []
+        # root -> the RefreshSchedule of the elements of the root, for the roots that are shown
+        self.schedules = {}
+        # output -> compressed output of the frames that are drawn, see compress
+        self._compressed = {}
+        if address is not None:
+            self.listen(address)
+
+    def listen(self, address):
+        sock = create_socket(address, listen=True)
+        sock.setblocking(False)
+        self.listeners.append(sock)
+        self.selector.register(sock, selectors.EVENT_READ)
+
+    def add_root(self, root):
+        """Adds a root that all viewers can switch to, the first root is the one viewers see first"""
+        self.roots.append(root)
+        root.controller = self.controller
+        for conn in self.connections:
+            conn.controller.add_root(root)
+
+    def remove_root(self, root):
+        self.roots.remove(root)
+        self.schedules.pop(root, None)
+        for conn in self.connections:
+            conn.controller.remove_root(root)
+            conn.stale = True
+
+    def add_connection(self, sock: socket.socket) -> Connection:
+        """Serves the viewer connected to the socket, e.g. one end of a socketpair"""
+        sock.setblocking(False)
+        conn = Connection(self, sock)
+        conn.controller.scheduler.max_fps = self.max_fps
+        for root in self.roots:
+            conn.controller.add_root(root)
+        self.connections.append(conn)
+        self.selector.register(sock, selectors.EVENT_READ, conn)
+        return conn
+
+    def close_connection(self, conn: Connection):
+        if conn.closed:
+            return
+        conn.closed = True
+        self.connections.remove(conn)
+        self.selector.unregister(conn.sock)
+        conn.sock.close()
+        for root in self.roots:
+            if root.controller is conn.controller:
+                root.controller = self.controller
+
+    def watch(self, conn: Connection):
+        """Makes the selector wait until the connection can send if it has unsent bytes"""
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if conn.sending() else 0)
+        self.selector.modify(conn.sock, events, conn)
+
+    def shown_roots(self) -> dict:
+        """Returns the connections showing each active root"""
+        shown = {}
+        for conn in self.connections:
+            root = conn.controller.active_root
+            if root is not None:
+                shown.setdefault(root, []).append(conn)
+        return shown
+
+    def update(self):
+        """Fetches the invalidated content of all shown roots once for all of their viewers"""
+        controller = self.controller
+        if controller._completed:
+            # background results may have changed any root
+            for conn in self.connections:
+                conn.stale = True
+        controller.collect_background_results()
+        for root, conns in self.shown_roots().items():
+            if root._dirty or root._dirty_below:
+                for conn in conns:
+                    conn.stale = True
+                root.controller = conns[0].controller
+                root.update()
+
+    def draw_frames(self) -> float:
+        """
+        Draws a frame for every viewer that may see something new, unless it is still busy
+        receiving its last frame. Then it gets the changes of all frames it missed at once.
+        :return: The seconds until a frame that is due may be drawn, or None if no frame is due
+        """
+        self.update()
+        due = [conn for conn in self.connections
+               if conn.stale and conn.terminal.size is not None and conn.controller.active_root is not None]
+        # each root is only resized when the next group of viewers has a different size
+        due.sort(key=lambda conn: (id(conn.controller.active_root), conn.terminal.size))
+        waits = []
+        # viewers that saw the same frame last get the same changes, they are only computed once
+        shared = {}
+        for conn in due:
+            if conn.sending():
+                continue
+            ctl = conn.controller
+            ctl.active_root.controller = ctl
+            ctl.renderer.shared = shared
+            try:
+                wait = ctl.next_frame()
+            finally:
+                ctl.renderer.shared = None
+            if wait is None:
+                conn.stale = False
+            else:
+                waits.append(wait)
+        self._compressed.clear()
+        return min(waits, default=None)
+
+    def compress(self, output: str) -> bytes:
+        """Returns the compressed output, the same output is only compressed once per frame"""
+        compressed = self._compressed.get(output)
+        if compressed is None:
+            compressed = self._compressed[output] = zlib.compress(output.encode(), self.compression_level)
+        return compressed
+
+    def wait_time(self, frame_wait: float = None) -> float:
+        """Returns the seconds the server may wait for messages before it has something to do, None for no limit"""
+        now = self.controller.clock()
+        deadlines = [] if frame_wait is None else [now + frame_wait]
+        for schedule in self.schedules.values():
+            if schedule.heap:
+                deadlines.append(schedule.next_deadline())
+        for elem in self.controller._fetching:
+            if not elem._stale:
+                deadlines.append(elem._fetch_started + elem.fetch_timeout)
+        for conn in self.connections:
+            pending = conn.controller.input_parser.pending_timeout()
+            if pending is not None:
+                deadlines.append(now + pending)
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - now)
+
+    def handle_input(self, conn: Connection):
+        ctl = conn.controller
+        conn.stale = True
+        if ctl.active_root is not None:
+            # handlers such as Input place the cursor of the controller of their root
+            ctl.active_root.controller = ctl
+        try:
+            ctl.process_user_input()
+        except TerminationRequestedException:
+            self.close_connection(conn)
+
+    def refresh_if_due(self):
+        """Invalidates the elements of the shown roots whose refresh interval has passed"""
+        now = self.controller.clock()
+        shown = self.shown_roots()
+        for root in list(self.schedules):
+            if root not in shown:
+                del self.schedules[root]
+        for root in shown:
+            schedule = self.schedules.get(root)
+            if schedule is None:
+                schedule = self.schedules[root] = RefreshSchedule()
+            screen_map = ScreenMap.of(root)
+            if schedule.source is not screen_map:
+                schedule.build(screen_map, now)
+            schedule.run_due(now)
+
+    def step(self, timeout: float = None):
+        """
+        Draws the frames that are due, then waits for messages and handles them.
+        :param timeout: How long to wait for messages at most in seconds, None to wait until there is something to do
+        """
+        wait = self.wait_time(self.draw_frames())
+        if timeout is not None:
+            wait = timeout if wait is None else min(wait, timeout)
+        received = set()
+        for key, events in self.selector.select(wait):
+            if key.fileobj is self.waker.reader:
+                self.waker.drain()
+            elif key.fileobj in self.listeners:
+                try:
+                    sock, _ = key.fileobj.accept()
+                except BlockingIOError:
+                    continue
+                self.add_connection(sock)
+            else:
+                conn = key.data
+                if events & selectors.EVENT_WRITE and not conn.closed:
+                    conn.send_unsent()
+                if events & selectors.EVENT_READ and not conn.closed and conn.receive():
+                    received.add(conn)
+        for conn in list(self.connections):
+            if conn in received or conn.controller.input_parser.pending():
+                self.handle_input(conn)
+        self.refresh_if_due()
+
+    def serve_forever(self):
+        try:
+            while True:
+                self.step()
+        finally:
+            self.close()
+
+    def close(self):
+        for conn in list(self.connections):
+            self.close_connection(conn)
+        for sock in self.listeners:
+            self.selector.unregister(sock)
+            sock.close()
+        self.listeners.clear()
+
+
+def serve(root, address):
+    """Serves the root to viewers connecting to the address until the process is interrupted"""
+    server = Server(address)
+    server.add_root(root)
+    server.serve_forever()
+
+
+class Viewer:
+    """
+    Shows the frames of a Server and sends it the input and window size of the local terminal.
+    """
+
+    def __init__(self, address=None, sock: socket.socket = None):
+        """
+        :param address: The address of the server, see create_socket
+        :param sock: An already connected socket instead of an address
+        """
+        self.sock = sock or create_socket(address)
+        self._received = bytearray()
+
+    def send_input(self, data: bytes):
+        self.sock.sendall(encode_message(INPUT, data))
+
+    def send_size(self, width: int, height: int):
+        self.sock.sendall(encode_message(SIZE, SIZE_FORMAT.pack(width, height)))
+
+    def receive(self, timeout: float = None) -> str:
+        """
+        Waits for output of the server.
+        :param timeout: Seconds to wait at most, None to wait indefinitely
+        :return: The escape sequences and text of the received frames, '' if the timeout passed,
+                 None if the server closed the connection
+        """
+        self.sock.settimeout(timeout)
+        try:
+            data = self.sock.recv(READ_SIZE)
+        except (socket.timeout, BlockingIOError):
+            return ''
+        if not data:
+            return None
+        self._received += data
+        parts = [zlib.decompress(payload).decode()
+                 for kind, payload in decode_messages(self._received) if kind == OUTPUT]
+        return ''.join(parts)
+
+    def run(self, terminal: Terminal = None):
+        """Shows the frames on the terminal and sends its input until the server closes the connection"""
+        terminal = terminal or ConsoleTerminal()
+        backend = terminal.input_backend
+        done = threading.Event()
+
+        def show_frames():
+            try:
+                while True:
+                    output = self.receive()
+                    if output is None:
+                        break
+                    terminal.write(output)
+                    terminal.flush()
+            finally:
+                done.set()
+                backend.wake()
+
+        size = terminal.window_size()
+        self.send_size(*size)
+        receiver = threading.Thread(target=show_frames, daemon=True)
+        receiver.start()
+        try:
+            with backend:
+                while not done.is_set():
+                    data = backend.read(RESIZE_POLL_MILLIS)
+                    if data:
+                        self.send_input(data)
+                    if terminal.window_size() != size:
+                        size = terminal.window_size()
+                        self.send_size(*size)
+        except OSError:
+            # the server closed the connection
+            pass
+        finally:
+            self.sock.close()
+            terminal.write(RESET_STYLE + SHOW_CURSOR + '\n')
+            terminal.flush()
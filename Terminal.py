@@ -0,0 +1,164 @@
+import re
+import sys
+import shutil
+from collections import deque
+
+import InputBackend
+
+
+class Terminal:
+    """
+    Everything ticlif needs from a terminal:
+    its size, somewhere to write frames to and an input backend to read input from.
+    """
+
+    @property
+    def input_backend(self) -> InputBackend.InputBackend:
+        raise NotImplementedError
+
+    def window_size(self) -> tuple:
+        """Returns the width and height available for drawing"""
+        raise NotImplementedError
+
+    def write(self, s: str):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+
+class ConsoleTerminal(Terminal):
+    """The terminal the process is running in"""
+
+    def __init__(self, out=None, input_backend: InputBackend.InputBackend = None):
+        self.out = out or sys.stdout
+        self._input_backend = input_backend
+
+    @property
+    def input_backend(self) -> InputBackend.InputBackend:
+        if self._input_backend is None:
+            self._input_backend = InputBackend.default_backend()
+        return self._input_backend
+
+    def window_size(self) -> tuple:
+        w, h = shutil.get_terminal_size()
+        return w, h - 2
+
+    def write(self, s: str):
+        self.out.write(s)
+
+    def flush(self):
+        self.out.flush()
+
+
+class QueueInputBackend(InputBackend.InputBackend):
+    """Input backend that returns input queued with feed(), it never waits"""
+
+    def __init__(self):
+        self.queue = deque()
+
+    def feed(self, data: bytes):
+        self.queue.append(data)
+
+    def read(self, timeout_millis: int = 0) -> bytes:
+        return self.queue.popleft() if self.queue else None
+
+    def read_available(self) -> bytes:
+        return self.read()
+
+    def wake(self):
+        pass
+
+
+# the escape sequences written by the Renderer
+_SEQUENCE = re.compile(r'\x1b\[([0-9;?]*)([A-Za-z])')
+
+
+class VirtualTerminal(Terminal):
+    """
+    An in-memory terminal for tests and benchmarks.
+    Written text and the cursor positioning, clearing and style sequences of the Renderer
+    are applied to a virtual screen. The style of each cell is kept as the parameters
+    of the SGR sequence it was written with, e.g. '0;1;31'. Input is queued with feed().
+    """
+
+    def __init__(self, width: int = 80, height: int = 24):
+        self.width = width
+        self.height = height
+        self._input_backend = QueueInputBackend()
+        self.screen = [[' '] * width for _ in range(height)]
+        self.attributes = [['0'] * width for _ in range(height)]
+        self.style = '0'
+        self.cursor_x = 0
+        self.cursor_y = 0
+        self.bytes_written = 0
+        self.writes = 0
+
+    @property
+    def input_backend(self) -> InputBackend.InputBackend:
+        return self._input_backend
+
+    def feed(self, data: bytes):
+        self._input_backend.feed(data)
+
+    def resize(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.screen = [[' '] * width for _ in range(height)]
+        self.attributes = [['0'] * width for _ in range(height)]
+
+    def window_size(self) -> tuple:
+        return self.width, self.height
+
+    def rows(self) -> list:
+        """Returns the rows currently shown on the virtual screen"""
+        return [''.join(row) for row in self.screen]
+
+    def write(self, s: str):
+        self.bytes_written += len(s.encode())
+        self.writes += 1
+        pos = 0
+        for match in _SEQUENCE.finditer(s):
+            self._put(s[pos:match.start()])
+            self._apply(match.group(1), match.group(2))
+            pos = match.end()
+        self._put(s[pos:])
+
+    def _put(self, text: str):
+        if not text:
+            return
+        y = self.cursor_y
+        if '\r' not in text and '\n' not in text:
+            if 0 <= y < self.height and self.cursor_x < self.width:
+                start = max(0, self.cursor_x)
+                end = min(self.width, self.cursor_x + len(text))
+                self.screen[y][start:end] = text[start - self.cursor_x:end - self.cursor_x]
+                self.attributes[y][start:end] = [self.style] * (end - start)
+            self.cursor_x += len(text)
+            return
+        for c in text:
+            if c == '\r':
+                self.cursor_x = 0
+            elif c == '\n':
+                self.cursor_y += 1
+            elif 0 <= self.cursor_y < self.height and 0 <= self.cursor_x < self.width:
+                self.screen[self.cursor_y][self.cursor_x] = c
+                self.attributes[self.cursor_y][self.cursor_x] = self.style
+                self.cursor_x += 1
+            else:
+                self.cursor_x += 1
+
+    def _apply(self, params: str, final: str):
+        if final == 'H':
+            row, _, col = params.partition(';')
+            self.cursor_y = int(row or 1) - 1
+            self.cursor_x = int(col or 1) - 1
+        elif final == 'J' and params == '2':
+            self.screen = [[' '] * self.width for _ in range(self.height)]
+            self.attributes = [[self.style] * self.width for _ in range(self.height)]
+        elif final == 'K' and params == '2' and 0 <= self.cursor_y < self.height:
+            self.screen[self.cursor_y] = [' '] * self.width
+            self.attributes[self.cursor_y] = [self.style] * self.width
+        elif final == 'm':
+            self.style = params or '0'
+        # other sequences, e.g. showing and hiding the cursor, don't change the screen
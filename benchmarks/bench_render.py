@@ -0,0 +1,214 @@
+"""
+Rendering benchmarks for ticlif.
+
+Draws generated element trees on a VirtualTerminal and measures frame times,
+bytes written to the terminal, allocations and hit-test latency.
+The results are printed as JSON so that they can be compared between versions:
+
+    python benchmarks/bench_render.py --output results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ticlif
+from ticlif import Element, Input, Controller, Point, debug_info, Debug
+from Terminal import VirtualTerminal
+
+
+def deep_tree(depth: int = 40):
+    """Nested elements with alternating directions, each level shows a counter"""
+    counter = [0]
+    root = Element().with_id('deep')
+    elem = root
+    for level in range(depth):
+        child = Element().with_direction('horizontal' if level % 2 else 'vertical')
+        elem.with_child(Element().with_content(lambda _, level=level: 'level {} {}'.format(level, counter[0])))
+        elem.with_child(child)
+        elem = child
+    elem.with_content('bottom')
+    return root, counter
+
+
+def wide_tree(children: int = 100):
+    """A single horizontal split with many polled children"""
+    counter = [0]
+    root = Element().with_id('wide').with_direction('horizontal')
+    for i in range(children):
+        root.with_child(Element().with_content(lambda _, i=i: str(i + counter[0])))
+    return root, counter
+
+
+def long_content(lines: int = 10000):
+    """A leaf showing a text with many lines next to a small changing element"""
+    counter = [0]
+    text = '\n'.join('line {} of the long content'.format(i) for i in range(lines))
+    root = (Element().with_id('long')
+            .with_direction('horizontal')
+            .with_child(Element().with_content(text))
+            .with_child(Element().with_content(lambda _: 'frame {}'.format(counter[0]))))
+    return root, counter
+
+
+def example_layout():
+    """The layout of example.py"""
+    counter = [0]
+    root = (Element()
+            .with_id('.')
+            .with_direction('horizontal')
+            .with_child(Element()
+                        .with_id('.0')
+                        .with_child(Element()
+                                    .with_id('.0.0')
+                                    .with_content(lambda elem: debug_info(elem)))
+                        .with_child(Element()
+                                    .with_id('.0.1')
+                                    .with_content(lambda elem: Debug.recent_inputs)))
+            .with_child(Element()
+                        .with_id('.1')
+                        .with_child(Input()
+                                    .with_id('.1.0')
+                                    .with_content('write here'))
+                        .with_child(Element()
+                                    .with_id('.1.1')
+                                    .with_content(lambda _: str(root.pos_of_child(1))))
+                        .with_child(Element()
+                                    .with_id('.1.2:Counter')
+                                    .with_content(lambda _: 'counter: {}'.format(counter[0])))))
+    return root, counter
+
+
+SCENARIOS = {
+    'deep_nesting': deep_tree,
+    'wide_split': wide_tree,
+    'long_content': long_content,
+    'example_layout': example_layout,
+}
+
+
+def summary(samples: list) -> dict:
+    samples = sorted(samples)
+    return {
+        'mean': statistics.mean(samples),
+        'median': statistics.median(samples),
+        'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        'max': samples[-1],
+    }
+
+
+def run_scenario(make_tree, width: int, height: int, frames: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    terminal = VirtualTerminal(width, height)
+    ctl = Controller(terminal)
+    ctl.scheduler.max_fps = None
+    # debug_info and other helpers use the module level controller
+    ticlif.controller = ctl
+    root, counter = make_tree()
+    ctl.active_root = root
+
+    start = time.perf_counter()
+    ctl.next_frame()
+    cold_frame = time.perf_counter() - start
+    cold_bytes = terminal.bytes_written
+
+    # frames after something changed: a counter shown by polled elements and the cursor
+    frame_times = []
+    bytes_before = terminal.bytes_written
+    for _ in range(frames):
+        counter[0] += 1
+        ctl.refresh()
+        ctl.state.cursor = Point(rng.randrange(width), rng.randrange(height))
+        start = time.perf_counter()
+        ctl.next_frame()
+        frame_times.append(time.perf_counter() - start)
+    update_bytes = (terminal.bytes_written - bytes_before) / frames
+
+    # frames without any change
+    idle_times = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        ctl.next_frame()
+        idle_times.append(time.perf_counter() - start)
+
+    # allocations of a changed frame
+    tracemalloc.start()
+    counter[0] += 1
+    ctl.refresh()
+    snapshot_before = tracemalloc.take_snapshot()
+    ctl.next_frame()
+    snapshot_after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = snapshot_after.compare_to(snapshot_before, 'filename')
+    allocated = sum(max(0, stat.size_diff) for stat in stats)
+    blocks = sum(max(0, stat.count_diff) for stat in stats)
+
+    # hit tests at random positions
+    positions = [Point(rng.randrange(width), rng.randrange(height)) for _ in range(10000)]
+    ctl.screen_map()
+    start = time.perf_counter()
+    for pos in positions:
+        ctl.state.cursor = pos
+        ctl.element_under_cursor()
+    hit_test = (time.perf_counter() - start) / len(positions)
+
+    # a burst of cursor movements as produced by holding an arrow key
+    ctl.state.cursor = Point(0, 0)
+    start = time.perf_counter()
+    ctl.process_user_input(b'\x1b[C' * 500 + b'\x1b[B' * 500)
+    ctl.next_frame()
+    input_burst = time.perf_counter() - start
+
+    return {
+        'cold_frame_ms': cold_frame * 1000,
+        'cold_frame_bytes': cold_bytes,
+        'frame_ms': {k: v * 1000 for k, v in summary(frame_times).items()},
+        'frame_bytes': update_bytes,
+        'idle_frame_ms': {k: v * 1000 for k, v in summary(idle_times).items()},
+        'frame_alloc_bytes': allocated,
+        'frame_alloc_blocks': blocks,
+        'frame_peak_traced_bytes': peak,
+        'hit_test_us': hit_test * 1e6,
+        'input_burst_ms': input_burst * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=200)
+    parser.add_argument('--height', type=int, default=60)
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='run only this scenario, may be given more than once')
+    parser.add_argument('--output', help='write the results to this file instead of stdout')
+    args = parser.parse_args()
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'terminal': [args.width, args.height],
+        'frames': args.frames,
+        'scenarios': {},
+    }
+    for name in args.scenario or SCENARIOS:
+        results['scenarios'][name] = run_scenario(SCENARIOS[name], args.width, args.height, args.frames, args.seed)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
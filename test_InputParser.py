@@ -0,0 +1,38 @@
+from Command import Command
+from InputParser import InputParser, Paste, Modified, ALT, COMPACT_THRESHOLD
+
+
+def test_paste_spanning_compaction():
+    parser = InputParser(windows_scan_codes=False)
+    parser.push(b'a' * (COMPACT_THRESHOLD - 6))
+    assert list(parser.get()) == ['a'] * (COMPACT_THRESHOLD - 6)
+    parser.push(b'b' * 10 + b'\x1b[200~' + b'c' * 3000)
+    assert list(parser.get()) == ['b'] * 10
+    # compacts the buffer while the paste is incomplete
+    parser.push(b'c' * 1000 + b'\x1b[201~')
+    assert list(parser.get()) == [Paste('c' * 4000)]
+    assert not parser.pending()
+    parser.push(b'x')
+    assert list(parser.get()) == ['x']
+
+
+def test_timed_out_sequence_is_not_back():
+    parser = InputParser(windows_scan_codes=False, esc_timeout=0)
+    parser.push(b'\x1b[2')
+    assert list(parser.get()) == []
+    parser.push(b'a')
+    assert list(parser.get()) == ['a']
+
+
+def test_lone_esc_is_back():
+    parser = InputParser(windows_scan_codes=False, esc_timeout=0)
+    parser.push(b'\x1b')
+    assert list(parser.get()) == [Command.BACK]
+    parser.push(b'\x1b\x1b')
+    assert list(parser.get()) == [Command.BACK, Command.BACK]
+
+
+def test_alt_with_escape_sequence():
+    parser = InputParser(windows_scan_codes=False)
+    parser.push(b'\x1b\x1b[A')
+    assert list(parser.get()) == [Modified(Command.UP, ALT)]
@@ -1,16 +1,38 @@
 import os
 import sys
 import time
-import msvcrt
-import shutil
+import asyncio
+import inspect
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+import weakref
+from heapq import heapify, heappush, heappop
+from array import array
 from enum import Enum, unique, auto
-from collections import deque, namedtuple
+from collections import deque, namedtuple, OrderedDict
 
 import InputParser as ip
+import InputBackend
 from Command import Command
-
-CLEAR_CMD = 'cls'
+from Renderer import Renderer
+from FrameBuffer import FrameBuffer, Style, STYLES
+from GapBuffer import GapBuffer
+from LogFile import LogFile, INDEX_CHUNK
+from Terminal import Terminal, ConsoleTerminal
+from Profiler import Profiler, Histogram, PHASE
+
+CLEAR_CMD = 'cls' if os.name == 'nt' else 'clear'
+# milliseconds between refreshes of elements with polled content, see Element.with_refresh
 AUTO_REFRESH_INTERVAL = 1000
+# refresh options of Element.with_refresh besides an interval
+REFRESH_NEVER = 'never'
+REFRESH_ON_EVENT = 'event'
+# the main loop draws at most this many frames per second
+MAX_FPS = 60
+# number of threads that run background content functions
+BACKGROUND_WORKERS = 4
+# number of roots whose last frame and rendered rows are kept, see RootCache
+ROOT_CACHE_SIZE = 8
 
 
 def eprint(*args, **kwargs):
@@ -31,29 +53,66 @@ class DroppingList:
         self.values.append(x)
 
 
+class VersionedList(list):
+    """
+    A list that counts its modifications.
+    Elements displaying a VersionedList only join and flow its items
+    again when the version changed, instead of on every frame.
+    The elements are also invalidated whenever the list changes,
+    so they don't have to be polled.
+    """
+
+    def __init__(self, *args):
+        super(VersionedList, self).__init__(*args)
+        self.version = 0
+        self.observers = weakref.WeakSet()
+
+    def touch(self):
+        """Marks the list as changed, e.g. after one of its items was modified in place"""
+        self.version += 1
+        for elem in self.observers:
+            elem.invalidate()
+
+
+def _versioned(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.touch()
+        return result
+
+    wrapper.__name__ = name
+    return wrapper
+
+
+for _name in ['append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort', 'reverse',
+              '__setitem__', '__delitem__', '__iadd__', '__imul__']:
+    setattr(VersionedList, _name, _versioned(_name))
+
+
 _Point = namedtuple('Point', ['x', 'y'])
+# creates a Point without the argument handling of the namedtuple constructor
+_new_point = tuple.__new__
 
 
 class Point(_Point):
+    __slots__ = ()
+
     def __add__(self, other):
-        if isinstance(other, Point):
-            return Point(self.x + other.x, self.y + other.y)
+        # a Point is a tuple, so this also covers adding two Points
+        if type(other) is int:
+            return _new_point(Point, (self[0] + other, self[1] + other))
         if isinstance(other, tuple) and len(other) == 2:
-            return Point(self.x + other[0], self.y + other[1])
-        elif isinstance(other, int):
-            return Point(self.x + other, self.y + other)
-        else:
-            raise Exception("cannot add Point to {}".format(other))
+            return _new_point(Point, (self[0] + other[0], self[1] + other[1]))
+        raise Exception("cannot add Point to {}".format(other))
 
     def __sub__(self, other):
-        if isinstance(other, Point):
-            return Point(self.x - other.x, self.y - other.y)
+        if type(other) is int:
+            return _new_point(Point, (self[0] - other, self[1] - other))
         if isinstance(other, tuple) and len(other) == 2:
-            return Point(self.x - other[0], self.y - other[1])
-        elif isinstance(other, int):
-            return Point(self.x - other, self.y - other)
-        else:
-            raise Exception("cannot add Point to {}".format(other))
+            return _new_point(Point, (self[0] - other[0], self[1] - other[1]))
+        raise Exception("cannot subtract {} from Point".format(other))
 
     def __str__(self):
         return '(' + str(self.x) + ',' + str(self.y) + ')'
@@ -66,9 +125,11 @@ class Point(_Point):
     #         return iter((self.x, self.y))
 
 
+ORIGIN = Point(0, 0)
+
+
 def get_window_size() -> Point:
-    w, h = shutil.get_terminal_size()
-    return Point(w, h - 2)
+    return Point._make(controller.get_terminal().window_size())
 
 
 def flow_text(text: str, width: int) -> list:
@@ -82,31 +143,184 @@ def flow_text(text: str, width: int) -> list:
     return result
 
 
+def render_child(child) -> list:
+    """
+    Returns all rows of the given element.
+    Elements that only override get_content are rendered row by row.
+    """
+    if type(child).get_content is not Element.get_content:
+        return [child.get_content(row) for row in range(child.cur_size.y)]
+    return child.render()
+
+
 def clear():
     os.system(CLEAR_CMD)
 
 
-def do_draw(elem, state):
+class FrameScheduler:
+    """
+    Decides when the main loop draws a frame.
+    A frame is only drawn if the active root, its rendered rows or the cursor changed,
+    and at most max_fps frames are drawn per second.
+    """
+
+    def __init__(self, max_fps: int = MAX_FPS):
+        self.max_fps = max_fps
+        self.last_frame_time = None
+        # the root, its rows and the cursor of the last frame
+        self._drawn = None
+
+    def needs_frame(self, root, state) -> bool:
+        drawn = self._drawn
+        return (drawn is None or root._rendered is None or drawn[0] is not root
+                or drawn[1] is not root._rendered or drawn[2] != state.cursor)
+
+    def wait_time(self, now: float) -> float:
+        """Returns the seconds until the next frame may be drawn"""
+        if not self.max_fps or self.last_frame_time is None:
+            return 0
+        return max(0.0, self.last_frame_time + 1 / self.max_fps - now)
+
+    def drawn(self, now: float, root, state):
+        self.last_frame_time = now
+        self._drawn = (root, root._rendered, state.cursor)
+
+
+def do_draw(elem, state, renderer=None, rows: list = None):
+    """
+    Draws the element with the cursor.
+    :param rows: The rows to draw instead of rendering the element
+    :return: The drawn rows without the cursor
+    """
     if 'frame' not in state.properties:
         state.properties['frame'] = 0
     state.properties['frame'] += 1
-    clear()
-    (w, h) = get_window_size()
+    (w, h) = state.window_size
+
+    screen_map = ScreenMap.of(elem)
+    if rows is None:
+        rendered = profiled(PHASE, 'render', render_child, elem)
+        rows = rendered[:h]
+        frame = screen_map.frame(rendered, w, h)
+    else:
+        frame = FrameBuffer.from_rows(rows, w, screen_map.styles() if screen_map.width == w else None)
 
-    s = ""
-    for row in range(h):
-        line = elem.get_content(row)
-        if row == state.cursor.y:
-            line = line[:max(0, state.cursor.x)] + "$" + line[state.cursor.x + 1:]
-        s += line + '\n'
+    profiled(PHASE, 'write', (renderer or controller.renderer).draw, frame, state.cursor)
+    return rows
 
-    print(s)
+
+class RefreshSchedule:
+    """
+    Decides when the elements of the active root are refreshed, see Element.with_refresh.
+    Elements with the same interval share a timer and the timers are kept in a heap
+    ordered by their deadlines, so only the elements that are due are looked at.
+    The schedule is built from the elements of a ScreenMap and built again when the ScreenMap changes.
+    """
+
+    def __init__(self):
+        # the ScreenMap the schedule was built from
+        self.source = None
+        # interval in milliseconds -> elements refreshed with that interval
+        self.groups = {}
+        # elements that are refreshed after user input
+        self.on_event = []
+        # (deadline, interval) of each group
+        self.heap = []
+
+    def build(self, screen_map, now: float):
+        self.source = screen_map
+        groups = {}
+        on_event = []
+        for elem in screen_map.elements:
+            interval = elem.refresh_interval
+            if interval is None:
+                if not elem.polled:
+                    continue
+                on_event.append(elem)
+                interval = AUTO_REFRESH_INTERVAL
+            elif interval == REFRESH_ON_EVENT:
+                on_event.append(elem)
+                continue
+            elif interval == REFRESH_NEVER:
+                continue
+            groups.setdefault(interval, []).append(elem)
+        # timers that still have elements keep their deadlines
+        heap = [(deadline, interval) for deadline, interval in self.heap if interval in groups]
+        scheduled = {interval for _, interval in heap}
+        for interval in groups:
+            if interval not in scheduled:
+                heap.append((now + interval / 1000, interval))
+        heapify(heap)
+        self.groups = groups
+        self.on_event = on_event
+        self.heap = heap
+
+    def next_deadline(self) -> float:
+        """Returns the time at which the next elements are due, or None if no element is refreshed by time"""
+        return self.heap[0][0] if self.heap else None
+
+    def run_due(self, now: float):
+        """Invalidates the elements that are due"""
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            deadline, interval = heappop(heap)
+            for elem in self.groups[interval]:
+                elem.invalidate()
+            # if the loop fell behind, the missed refreshes are skipped
+            deadline += interval / 1000
+            heappush(heap, (deadline if deadline > now else now + interval / 1000, interval))
+
+
+class RootCache:
+    """
+    Keeps the last frame of the most recently shown roots,
+    so that a root is drawn right away when it is shown again
+    while its content is fetched and rendered again.
+    Roots that drop out of the cache also lose their rendered rows and ScreenMap,
+    so only the cached roots hold on to rendering memory.
+    """
+
+    def __init__(self, max_roots: int = ROOT_CACHE_SIZE, max_chars: int = None):
+        """
+        :param max_roots: How many roots are kept at most, at least 1
+        :param max_chars: If given, roots are also dropped while their frames have more characters in total
+        """
+        self.max_roots = max(1, max_roots)
+        self.max_chars = max_chars
+        # root -> (size, rows), the most recently stored root last
+        self.frames = OrderedDict()
+        # the characters of the cached frames
+        self.chars = 0
+
+    def get(self, root, size: Point) -> list:
+        """Returns the last frame of the root if it has the given size, otherwise None"""
+        entry = self.frames.get(root)
+        if entry is None or entry[0] != size:
+            return None
+        return entry[1]
+
+    def store(self, root, size: Point, rows: list):
+        self.discard(root, drop=False)
+        self.frames[root] = (size, rows)
+        # the rows are as wide as the window
+        self.chars += size[0] * len(rows)
+        while len(self.frames) > self.max_roots or (
+                self.max_chars is not None and self.chars > self.max_chars and len(self.frames) > 1):
+            self.discard(next(iter(self.frames)))
+
+    def discard(self, root, drop: bool = True):
+        """Removes the root from the cache and drops its rendered rows if drop is set"""
+        entry = self.frames.pop(root, None)
+        if entry is not None:
+            self.chars -= entry[0][0] * len(entry[1])
+            if drop:
+                root.drop_caches()
 
 
 class State:
     def __init__(self):
-        self._window_size = Point(0, 0)
-        self.cursor = Point(0, 0)
+        self._window_size = ORIGIN
+        self.cursor = ORIGIN
         self.properties = {}
 
     @property
@@ -120,10 +334,56 @@ class State:
         self._window_size = size
 
 
+# content values that never change and therefore don't have to be polled
+STATIC_CONTENT_TYPES = (str, int, float, bool, type(None), VersionedList)
+
+
+# how each cursor command moves the cursor
+CURSOR_MOVES = {
+    Command.RIGHT: (1, 0),
+    Command.LEFT: (-1, 0),
+    Command.DOWN: (0, 1),
+    Command.UP: (0, -1),
+}
+
+# commands that are offered to the elements under the cursor before they move the cursor
+NAVIGATION_COMMANDS = {Command.UP, Command.DOWN, Command.LEFT, Command.RIGHT,
+                       Command.PAGE_UP, Command.PAGE_DOWN, Command.HOME, Command.END}
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
 class Controller:
-    def __init__(self):
+    def __init__(self, terminal: Terminal = None):
         self.state = State()
         self.input_parser = ip.InputParser()
+        # the console terminal is created on first use, see get_terminal
+        self.terminal = terminal
+        self.renderer = Renderer(terminal)
+        # taken from the terminal on first use, see get_input_backend
+        self.input_backend = None
+        # set while async_loop is running
+        self.event_loop = None
+        self.redraw_event = None
+        self.scheduler = FrameScheduler()
+        self.refresh_schedule = RefreshSchedule()
+        self.root_cache = RootCache()
+        # the root that was drawn last, see next_frame
+        self._drawn_root = None
+        # runs background content functions, created on first use
+        self.executor = None
+        # background fetches that completed and whose callbacks have not been called yet
+        self._completed = deque()
+        # elements with background fetches that may time out
+        self._fetching = set()
+        # when the inputs that were handled since the last frame were read, see Debug.input_latency
+        self._unpainted = []
+        # returns the current time for frames and refreshes, a replay puts the time of the recording here
+        self.clock = time.monotonic
+        # set to a Recorder to record the input and window sizes, see Recorder.py
+        self.recorder = None
         # self.roots = set()
         self.last_roots = deque()
         # self._active_root = None
@@ -140,6 +400,7 @@ class Controller:
             pass
         self.last_roots.append(root)
         root.controller = self
+        self.root_shown()
 
     def add_root(self, root):
         if root not in self.last_roots:
@@ -148,12 +409,17 @@ class Controller:
 
     def remove_active(self):
         self.last_roots.pop()
+        self.root_shown()
 
     def remove_root(self, root):
+        was_active = root is self.active_root
         try:
             self.last_roots.remove(root)
         except ValueError:
             pass
+        self.root_cache.discard(root, drop=False)
+        if was_active:
+            self.root_shown()
 
     def switch_to_next_root(self):
         try:
@@ -161,42 +427,188 @@ class Controller:
         except IndexError:
             # happens if there are no roots
             pass
+        self.root_shown()
+
+    def root_shown(self):
+        """
+        Called when a different root became the active root.
+        Inactive roots are not updated, so their polled elements are stale.
+        """
+        root = self.active_root
+        if root is not None:
+            root.invalidate_polled()
+
+    def refresh(self):
+        """Invalidates all polled elements of the active root, except those that are never refreshed"""
+        root = self.active_root
+        if root is not None:
+            root.invalidate_polled()
+
+    def refresh_after_input(self):
+        """Invalidates the elements of the active root that are refreshed after user input"""
+        schedule = self._schedule()
+        if schedule is not None:
+            for elem in schedule.on_event:
+                elem.invalidate()
+
+    def refresh_if_due(self):
+        """Invalidates the elements of the active root whose refresh interval has passed"""
+        schedule = self._schedule()
+        if schedule is not None:
+            schedule.run_due(self.clock())
+
+    def _schedule(self):
+        """Returns the refresh schedule of the active root, or None if there is no active root"""
+        if self.active_root is None:
+            return None
+        screen_map = self.screen_map()
+        if self.refresh_schedule.source is not screen_map:
+            self.refresh_schedule.build(screen_map, self.clock())
+        return self.refresh_schedule
+
+    def next_frame(self) -> float:
+        """
+        Updates the active root and draws a frame if anything changed and the frame rate allows it.
+        :return: The seconds until a frame that is due may be drawn, or None if no frame is due
+        """
+        prof = Debug.profiler
+        if prof is not None:
+            prof.begin_frame()
+        drawn = False
+        try:
+            root = self.active_root
+            if root is not None and root is not self._drawn_root:
+                self._drawn_root = root
+                rows = self.root_cache.get(root, Point._make(self.get_terminal().window_size()))
+                if rows is not None:
+                    # show the last frame of the root right away, the next frame brings it up to date
+                    do_draw(root, self.state, self.renderer, rows)
+                    drawn = True
+                    return 0
+            profiled(PHASE, 'update', self.update)
+            root = self.active_root
+            if root is None or not self.scheduler.needs_frame(root, self.state):
+                # the inputs did not change what is shown
+                self._unpainted.clear()
+                return None
+            now = self.clock()
+            wait = self.scheduler.wait_time(now)
+            if wait > 0:
+                return wait
+            rows = do_draw(root, self.state, self.renderer)
+            self.root_cache.store(root, self.state.window_size, rows)
+            self._drawn_root = root
+            self.scheduler.drawn(now, root, self.state)
+            drawn = True
+            self._painted()
+            return None
+        finally:
+            if prof is not None:
+                prof.end_frame(drawn)
+
+    def wait_millis(self, frame_wait: float = None) -> int:
+        """
+        Returns how long the main loop may wait for input before it has something to do.
+        :return: The milliseconds to wait or 0 to wait until there is input
+        """
+        now = self.clock()
+        deadlines = [] if frame_wait is None else [now + frame_wait]
+        schedule = self._schedule()
+        if schedule is not None and schedule.heap:
+            deadlines.append(schedule.next_deadline())
+        for elem in self._fetching:
+            if not elem._stale:
+                # the stale marker has to be shown when the fetch times out
+                deadlines.append(elem._fetch_started + elem.fetch_timeout)
+        if not deadlines:
+            return self.input_timeout_millis(0)
+        return self.input_timeout_millis(int(max(0.0, min(deadlines) - now) * 1000) + 1)
+
+    def _painted(self):
+        """Records the latency of the inputs whose effect was just written to the terminal"""
+        if self._unpainted:
+            now = time.perf_counter()
+            for read_time in self._unpainted:
+                Debug.input_latency.add(now - read_time)
+            self._unpainted.clear()
 
     def update(self):
-        win_size = get_window_size()
+        """Resizes the active root if needed and fetches its invalidated content"""
+        self.collect_background_results()
+        win_size = Point._make(self.get_terminal().window_size())
         if win_size != self.state.window_size:
             self.state.window_size = win_size
-            for root in self.last_roots:
+            if self.recorder is not None:
+                self.recorder.record_size(*win_size)
+        root = self.active_root
+        if root is not None:
+            if root.cur_size != win_size:
+                # roots are only resized when they are shown
                 root.resize(win_size)
-        for root in self.last_roots:
             root.update()
 
-    def process_user_input(self, user_input):
-        root = self.active_root
-        state = self.state
+    def receive_input(self, user_input: bytes, timestamp: float = None):
+        """
+        Queues raw input for process_user_input.
+        :param timestamp: When the input was read, as returned by time.perf_counter(), defaults to now
+        """
         Debug.recent_inputs_raw.append(user_input)
-        self.input_parser.push(user_input)
-        for input in self.input_parser.get():
+        if self.recorder is not None:
+            self.recorder.record_input(user_input, timestamp)
+        self.input_parser.push(user_input, timestamp)
+
+    def process_user_input(self, user_input: bytes = b'', timestamp: float = None):
+        """
+        Handles the given and all previously received input.
+        :param timestamp: When the input was read, as returned by time.perf_counter(), defaults to now
+        """
+        state = self.state
+        if user_input:
+            self.receive_input(user_input, timestamp)
+        if self.recorder is not None:
+            self.recorder.record_handling()
+        parser = self.input_parser
+        inputs = []
+        read_times = []
+        for input in parser.get():
+            inputs.append(input)
+            read_times.append(parser.timestamp)
+        unpainted = self._unpainted
+        i = 0
+        while i < len(inputs):
+            input = inputs[i]
+            unpainted.append(read_times[i])
+            i += 1
             Debug.recent_inputs.append(input)
-            if input == Command.RIGHT:
-                state.cursor = Point(min(get_window_size().x - 1, state.cursor.x + 1), state.cursor.y)
-            elif input == Command.LEFT:
-                state.cursor = Point(max(0, state.cursor.x - 1), state.cursor.y)
-            elif input == Command.DOWN:
-                state.cursor = Point(state.cursor.x, min(get_window_size().y - 1, state.cursor.y + 1))
-            elif input == Command.UP:
-                state.cursor = Point(state.cursor.x, max(0, state.cursor.y - 1))
+            start = time.perf_counter()
+            if input in CURSOR_MOVES and input not in self.screen_map().navigated:
+                # no element wants to see the single moves, so a run of equal moves is applied at once
+                n = 1
+                while i < len(inputs) and inputs[i] == input:
+                    Debug.recent_inputs.append(input)
+                    unpainted.append(read_times[i])
+                    n += 1
+                    i += 1
+                self.move_cursor(input, n)
+            elif input in NAVIGATION_COMMANDS and self.navigate(input):
+                # consumed by an element, e.g. to scroll
+                pass
+            elif input in CURSOR_MOVES:
+                self.move_cursor(input, 1)
             elif input == Command.SWITCH:
                 self.switch_to_next_root()
             elif input == Command.NEXT:
-                controller.move_cursor_to_next()
+                self.move_cursor_to_next()
             elif input == Command.BACK:
                 raise TerminationRequestedException
             else:
                 event = Event()
                 event.pos = state.cursor
                 event.key = input
-                root.action(event)
+                self.dispatch(event)
+            Debug.input_handling.add(time.perf_counter() - start)
+        # handlers and input may have changed what polled elements display
+        self.refresh_after_input()
 
         # if user_input == b'\x03':
         #     raise KeyboardInterrupt
@@ -226,73 +638,440 @@ class Controller:
         # #     print("exiting. input was: " + str(user_input))
         # #     break
 
+    def request_redraw(self):
+        """Wakes up the main loop so that it draws a new frame. May be called from any thread."""
+        if self.redraw_event is not None:
+            self.event_loop.call_soon_threadsafe(self.redraw_event.set)
+        elif self.input_backend is not None:
+            self.input_backend.wake()
+
+    def submit(self, fn, *args, callback=None):
+        """
+        Runs fn(*args) on the thread pool for background content functions.
+        When it completes, a redraw is requested and callback is called with
+        the future during the next update, i.e. on the thread of the main loop.
+        :return: The future
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix='ticlif')
+        future = self.executor.submit(fn, *args)
+
+        def done(f):
+            self._completed.append((f, callback))
+            self.request_redraw()
+
+        future.add_done_callback(done)
+        return future
+
+    def collect_background_results(self):
+        """Calls the callbacks of completed background fetches and marks fetches that timed out as stale"""
+        while self._completed:
+            future, callback = self._completed.popleft()
+            if callback:
+                callback(future)
+        if self._fetching:
+            now = self.clock()
+            for elem in list(self._fetching):
+                if not elem.check_stale(now):
+                    self._fetching.discard(elem)
+
+    def spawn(self, awaitable, callback=None, errback=None):
+        """
+        Runs an awaitable, e.g. the coroutine returned by an async content function or handler.
+        While async_loop is running, the awaitable runs as a task on its event loop
+        and a redraw is requested when it finishes.
+        Otherwise it is run to completion right away.
+        :param awaitable: The awaitable to run
+        :param callback: Called with the result of the awaitable
+        :param errback: Called with the exception if the awaitable raised one, instead of raising it
+        :return: The task or None if the awaitable already completed
+        """
+        if self.event_loop is None:
+            try:
+                result = asyncio.run(_await(awaitable))
+            except Exception as e:
+                if errback is None:
+                    raise
+                errback(e)
+                return None
+            if callback:
+                callback(result)
+            return None
+
+        def done(task):
+            if task.cancelled():
+                return
+            self.request_redraw()
+            error = task.exception()
+            if error is not None and errback is not None:
+                errback(error)
+                return
+            result = task.result()
+            if callback:
+                callback(result)
+
+        task = asyncio.ensure_future(awaitable, loop=self.event_loop)
+        task.add_done_callback(done)
+        return task
+
+    def input_timeout_millis(self, timeout_millis: int) -> int:
+        """
+        Returns how long to wait for input at most.
+        This is shorter than timeout_millis if the parser waits for the rest of an escape sequence.
+        """
+        pending = self.input_parser.pending_timeout()
+        if pending is None:
+            return timeout_millis
+        if timeout_millis <= 0:
+            return int(pending * 1000) + 1
+        return max(1, min(timeout_millis, int(pending * 1000) + 1))
+
+    def get_terminal(self) -> Terminal:
+        if self.terminal is None:
+            self.terminal = ConsoleTerminal()
+        return self.terminal
+
+    def get_input_backend(self) -> InputBackend.InputBackend:
+        if self.input_backend is None:
+            self.input_backend = self.get_terminal().input_backend
+        return self.input_backend
+
+    def screen_map(self):
+        """Returns the ScreenMap of the active root, it is rebuilt if the layout changed"""
+        return ScreenMap.of(self.active_root)
+
     def element_under_cursor(self):
-        return self.active_root.element_at(self.state.cursor)
+        return self.screen_map().element_at(self.state.cursor)
+
+    def dispatch(self, event):
+        """
+        Passes the event to the outermost element at event.pos that has a handler.
+        event.pos is made relative to that element.
+        """
+        screen_map = self.screen_map()
+        elem = screen_map.element_at(event.pos)
+        if elem is None:
+            return
+        handler = None
+        while elem is not None:
+            if elem.event_handler:
+                handler = elem
+            elem = elem.parent
+        if handler:
+            event.pos -= screen_map.position_of(handler)
+            handler.action(event)
+
+    def move_cursor(self, command, n: int):
+        """Moves the cursor n times in the direction of the cursor command, staying inside the window"""
+        dx, dy = CURSOR_MOVES[command]
+        w, h = self.state.window_size
+        x, y = self.state.cursor
+        self.state.cursor = Point(max(0, min(w - 1, x + dx * n)), max(0, min(h - 1, y + dy * n)))
+
+    def navigate(self, command) -> bool:
+        """
+        Offers a navigation command to the element under the cursor and then to its ancestors.
+        :return: True if an element consumed the command
+        """
+        screen_map = self.screen_map()
+        elem = screen_map.element_at(self.state.cursor)
+        while elem is not None:
+            if elem.navigate(command, self.state.cursor - screen_map.position_of(elem)):
+                return True
+            elem = elem.parent
+        return False
 
     def move_cursor_to_next(self):
         current = self.element_under_cursor()
         next = self.element_after(current)
-        self.move_cursor_to(next)
+        if next is not None:
+            self.move_cursor_to(next)
 
     def element_after(self, elem):
-        if elem is self.active_root:
-            # roots have no next element
-            return elem
-
-        return elem.next_sibling or self.element_after(elem.parent)
+        """Returns the next sibling of the element or of its closest ancestor that has one, or the active root"""
+        return self.screen_map().element_after(elem)
 
     def move_cursor_to(self, elem):
-        new_position = elem.absolute_position()
+        new_position = self.screen_map().position_of(elem)
+        if new_position is None:
+            new_position = elem.absolute_position()
         self.state.cursor = new_position
 
 
+def _static_content(elem):
+    """The content function of elements whose content is not a function, see Element.with_content"""
+    return elem.static_content
+
+
+# shared by all elements without children, with_child replaces it by a list
+_NO_CHILDREN = ()
+_NO_INDEX = {}
+
+
+def _navigation_commands(cls) -> frozenset:
+    """Returns the navigation commands that elements of the class may consume"""
+    if cls.navigate is Element.navigate:
+        return frozenset()
+    return cls.navigation_commands
+
+
 class Element:
+    # trees can have a lot of elements, slots keep each of them small
+    __slots__ = ('halign', 'valign', 'min_size', '_own_min_size', 'max_size', 'weight', 'rel_pos', 'cur_size', 'direction',
+                 'separator_char', 'refresh_interval', 'style',
+                 'separate', 'fetch_content', 'static_content', 'polled', 'content',
+                 '_dirty', '_dirty_below', '_rendered', '_uncacheable', '_flow_key', '_flown',
+                 'background', 'fetch_timeout', 'stale_marker', 'max_pending', '_pending', '_fetch_count',
+                 '_shown_fetch', '_fetch_started', '_stale', 'parent', '__controller', 'children',
+                 '_offsets', '_child_index', 'event_handler', 'id', '_screen_map', '__weakref__')
+    # the commands that navigate may consume, runs of other cursor moves are applied at once
+    navigation_commands = frozenset(NAVIGATION_COMMANDS)
+    # the cells between the edges of this element and its children, e.g. of a Border
+    inset = 0
+
     def __init__(self):
         self.halign = 'left'
         self.valign = 'top'
-        self.min_size = Point(0, 0)
-        self.rel_pos = Point(0, 0)
-        self.cur_size = Point(0, 0)
+        # the size set with with_min_size, min_size also covers the min_size of the children
+        self._own_min_size = ORIGIN
+        self.min_size = ORIGIN
+        # None means unbounded, see with_max_size
+        self.max_size = None
+        self.weight = 1
+        self.rel_pos = ORIGIN
+        self.cur_size = ORIGIN
         self.direction = 'vertical'
         self.separator_char = None
         self.separate = True
-        self.fetch_content = lambda self: ''
+        self.fetch_content = _static_content
+        self.static_content = ''
+        self.polled = False
+        # None refreshes polled content after user input and every AUTO_REFRESH_INTERVAL, see with_refresh
+        self.refresh_interval = None
+        # id of the style in STYLES, None for the style of the parent, see with_style
+        self.style = None
         self.content = None
+        # whether this element must fetch its content again
+        self._dirty = True
+        # whether a descendant of this element must fetch its content again
+        self._dirty_below = False
+        self._rendered = None
+        # set if a descendant only overrides get_content, its rows can't be cached
+        self._uncacheable = False
+        self._flow_key = None
+        self._flown = None
+        # see with_content
+        self.background = False
+        self.fetch_timeout = None
+        self.stale_marker = None
+        self.max_pending = 1
+        # unfinished tasks or futures fetching content, replaced by a list by _can_fetch
+        self._pending = ()
+        self._fetch_count = 0
+        self._shown_fetch = 0
+        self._fetch_started = 0
+        self._stale = False
         self.parent: Element = None
         self.__controller = None
-        self.children = []
+        self.children = _NO_CHILDREN
+        # offset of each child along the direction and the index of each child, built by resize
+        self._offsets = None
+        self._child_index = None
         self.event_handler = None
         self.id = None
+        # only used for roots, see Controller.screen_map
+        self._screen_map = None
 
     def __str__(self):
         return self.id or super(Element, self).__str__()
 
     @property
     def controller(self):
-        return self.__controller or self.parent.controller
+        if self.__controller or self.parent is None:
+            return self.__controller
+        return self.parent.controller
 
     @controller.setter
     def controller(self, controller):
+        # descendants without a controller of their own use the one of their root
         self.__controller = controller
+
+    def update(self, force: bool = False):
+        """
+        Fetches the content of this element and its descendants if they were invalidated.
+        :param force: If True, the content of the whole subtree is fetched
+        """
+        if force or self._dirty:
+            self._dirty = False
+            if Debug.profiler is None:
+                self.refetch()
+            else:
+                profiled('fetch', self, self.refetch)
+        if force or self._dirty_below:
+            self._dirty_below = False
+            self.update_children(force)
+
+    def update_children(self, force: bool = False):
         for child in self.children:
-            child.controller = controller
+            child.update(force)
 
-    def update(self):
-        self.content = self.fetch_content(self)
-        self.update_children()
+    def refetch(self):
+        """
+        Fetches the content.
+        If the content function returned an awaitable, the current content
+        is kept until the awaitable has completed.
+        """
+        if self.background:
+            self.fetch_in_background()
+            return
+        value = self.fetch_content(self)
+        if inspect.isawaitable(value):
+            self.await_content(value)
+        else:
+            self.show_content(value)
+
+    def _can_fetch(self) -> bool:
+        self._pending = [p for p in self._pending if not p.done()]
+        return len(self._pending) < self.max_pending
+
+    def await_content(self, awaitable):
+        """Shows the result of the awaitable as content once it is available"""
+        if not self._can_fetch():
+            # too many fetches are still running
+            if inspect.iscoroutine(awaitable):
+                awaitable.close()
+            return
+        task = (self.controller or controller).spawn(awaitable, self._fetched, self._fetch_failed)
+        if task is not None:
+            self._pending.append(task)
+
+    def fetch_in_background(self):
+        """Runs the content function on the thread pool of the controller, see with_content"""
+        if not self._can_fetch():
+            return
+        ctl = self.controller or controller
+        self._fetch_count += 1
+        fetch = self._fetch_count
+        if not self._pending:
+            self._fetch_started = ctl.clock()
+        future = ctl.submit(self.fetch_content, self, callback=lambda f: self._fetched_in_background(f, fetch))
+        self._pending.append(future)
+        if self.fetch_timeout is not None:
+            ctl._fetching.add(self)
+
+    def _fetched_in_background(self, future, fetch):
+        if future.cancelled() or fetch < self._shown_fetch:
+            # a newer result is already shown
+            return
+        try:
+            value = future.result()
+        except Exception as e:
+            self._fetch_failed(e)
+            return
+        self._shown_fetch = fetch
+        self._fetched(value)
+
+    def _fetched(self, value):
+        """Shows the result of a background or async fetch"""
+        if self._stale:
+            self._stale = False
+            self.invalidate_render()
+        self.show_content(value)
+
+    def _fetch_failed(self, error: Exception):
+        """
+        Keeps the last content and marks it as stale after a background or async content function raised,
+        e.g. because a status file is missing for a moment, until a fetch succeeds
+        """
+        Debug.fetch_errors.append(error)
+        if not self._stale:
+            self._stale = True
+            self.invalidate_render()
 
-    def update_children(self):
+    def check_stale(self, now: float) -> bool:
+        """
+        Marks the content as stale if a background fetch has been running for longer than the timeout.
+        Fetches that timed out before they even started are cancelled.
+        :return: Whether a background fetch is still running
+        """
+        self._pending = [p for p in self._pending if not p.done()]
+        if not self._pending:
+            return False
+        if not self._stale and now - self._fetch_started >= self.fetch_timeout:
+            self._stale = True
+            self.invalidate_render()
+            for p in self._pending:
+                p.cancel()
+        return True
+
+    def show_content(self, value):
+        """Sets the content and invalidates the rendered rows if the displayed text changed"""
+        was_none = self.content is None
+        old_flown = self._flown
+        self.content = value
+        if (self.children or was_none or self.content is None or self.cur_size.x <= 0
+                or self.flown_content(self.cur_size.x) is not old_flown):
+            self.invalidate_render()
+
+    def invalidate(self):
+        """Marks this element so that its content is fetched again before the next frame"""
+        self._dirty = True
+        self._mark_ancestors_dirty()
+
+    def _mark_ancestors_dirty(self):
+        elem = self.parent
+        while elem is not None and not elem._dirty_below:
+            elem._dirty_below = True
+            elem = elem.parent
+
+    def invalidate_polled(self):
+        """Invalidates all elements in this subtree whose content has to be polled, except those that are never refreshed"""
+        if self.polled and self.refresh_interval != REFRESH_NEVER:
+            self.invalidate()
+        for child in self.children:
+            child.invalidate_polled()
+
+    def invalidate_layout(self):
+        """Drops the ScreenMap of the root of this element"""
+        elem = self
+        while elem.parent is not None:
+            elem = elem.parent
+        elem._screen_map = None
+
+    def drop_caches(self):
+        """Drops the rendered rows, flowed content and ScreenMap of this subtree to free their memory"""
+        self._rendered = None
+        self._flow_key = None
+        self._flown = None
+        self._screen_map = None
         for child in self.children:
-            child.update()
+            child.drop_caches()
+
+    def invalidate_render(self):
+        """Drops the rendered rows of this element and its ancestors"""
+        elem = self
+        while elem is not None:
+            elem._rendered = None
+            elem = elem.parent
 
     def is_active_root(self):
         return self.parent is None
 
     def absolute_position(self) -> Point:
-        if self.is_active_root() or self.parent is None:
-            return Point(0, 0)
-
-        return self.parent.absolute_position() + self.parent.pos_of_child(self)
+        x = y = 0
+        elem = self
+        while elem.parent is not None:
+            parent = elem.parent
+            offset = parent._index()[parent.index_of_child(elem)]
+            inset = parent.inset
+            if parent.direction == 'vertical':
+                x += inset
+                y += offset + inset
+            else:
+                x += offset + inset
+                y += inset
+            elem = parent
+        return Point(x, y)
 
     def next_element(self):
         """
@@ -306,50 +1085,165 @@ class Element:
     def next_sibling(self):
         if self.parent is None:
             return None
-        idx_of_next = self.parent.children.index(self) + 1
+        idx_of_next = self.parent.index_of_child(self) + 1
         if not idx_of_next < len(self.parent.children):
             return None
         return self.parent.children[idx_of_next]
 
-
     def next_child(self, child):
         """Returns the child after the specified child"""
-        for i in range(len(self.children)):
-            if self.children[i] is child:
-                if i + 1 < len(self.children):
-                    return self.children[i + 1]
-                else:
-                    return self.parent.next_child(self) if self.parent else None
-        raise Exception("given child is not a child of this parent")
+        i = self.index_of_child(child)
+        if i is None:
+            raise Exception("given child is not a child of this parent")
+        if i + 1 < len(self.children):
+            return self.children[i + 1]
+        return self.parent.next_child(self) if self.parent else None
+
+    def index_of_child(self, child) -> int:
+        """Returns the index of the child in children or None if it is not a child of this element"""
+        return self._indices().get(child)
+
+    def _indices(self) -> dict:
+        """Returns the index of each child, which the methods changing the children keep up to date"""
+        child_index = self._child_index
+        if child_index is None or child_index is _NO_INDEX or len(child_index) != len(self.children):
+            child_index = self._child_index = {child: i for i, child in enumerate(self.children)}
+        return child_index
 
     def resize(self, size: Point):
         self.cur_size = size
-        if len(self.children) > 0:
-            if self.direction == 'vertical':
-                space_left = size.y
-                if self.separate:
-                    space_left -= len(self.children) - 1
-                child_size = Point(size.x, space_left // len(self.children))
-                last_child_size = child_size + Point(0, space_left % len(self.children))
-            else:
-                space_left = size.x
-                if self.separate:
-                    space_left -= len(self.children) - 1
-                child_size = Point(space_left // len(self.children), size.y)
-                last_child_size = child_size + Point(space_left % len(self.children), 0)
+        self.invalidate_render()
+        self.invalidate_layout()
+        children = self.children
+        if children:
+            vertical = self.direction == 'vertical'
+            space = size[1] if vertical else size[0]
+            if self.separate:
+                space -= len(children) - 1
+            for child, length in zip(children, self.child_lengths(space)):
+                child_size = Point(size[0], length) if vertical else Point(length, size[1])
+                # the layout of a child that keeps its size is still valid
+                if child.cur_size != child_size:
+                    child.resize(child_size)
+        self.build_index()
+
+    def child_lengths(self, space: int) -> list:
+        """
+        Divides the space along the direction among the children.
+        The space is divided in proportion to the weights of the children,
+        children whose share is below their min_size or above their max_size
+        get that size instead and the rest is divided among the others again.
+        The last child gets what is left over from rounding.
+        :param space: The rows or columns available to the children
+        :return: The length of each child along the direction
+        """
+        children = self.children
+        n = len(children)
+        axis = 1 if self.direction == 'vertical' else 0
+        mins = [child.min_size[axis] for child in children]
+        total_min = sum(mins)
+        if space <= total_min:
+            # not even the minimum sizes fit, they are scaled down
+            space = max(0, space)
+            if total_min == 0:
+                return [0] * n
+            lengths = [space * m // total_min for m in mins]
+            lengths[-1] += space - sum(lengths)
+            return lengths
+
+        maxs = [sys.maxsize if child.max_size is None else max(m, child.max_size[axis])
+                for child, m in zip(children, mins)]
+        lengths = [0] * n
+        growing = list(range(n))
+        # a single pass unless shares hit a limit, then one more for each round of limited children
+        while growing:
+            weight = sum(children[i].weight for i in growing)
+            given = 0
+            for i in growing:
+                lengths[i] = space * children[i].weight // weight if weight > 0 else 0
+                given += lengths[i]
+            lengths[growing[-1]] += space - given
+            # positive if the minimum sizes add more than the maximum sizes take away
+            violation = 0
+            limited = False
+            for i in growing:
+                if lengths[i] < mins[i]:
+                    violation += mins[i] - lengths[i]
+                    limited = True
+                elif lengths[i] > maxs[i]:
+                    violation -= lengths[i] - maxs[i]
+                    limited = True
+            if not limited:
+                break
+            # the children on the side that won keep their limit, the others share the rest
+            still_growing = []
+            for i in growing:
+                if violation >= 0 and lengths[i] < mins[i]:
+                    lengths[i] = mins[i]
+                elif violation <= 0 and lengths[i] > maxs[i]:
+                    lengths[i] = maxs[i]
+                else:
+                    still_growing.append(i)
+                    continue
+                space -= lengths[i]
+            growing = still_growing
+        return lengths
+
+    def build_index(self):
+        """Builds the offsets of the children from their current sizes"""
+        if not self.children:
+            self._offsets = _NO_CHILDREN
+            self._child_index = _NO_INDEX
+            return
+        offsets = []
+        pos = 0
+        gap = 1 if self.separate else 0
+        vertical = self.direction == 'vertical'
+        for child in self.children:
+            offsets.append(pos)
+            pos += (child.cur_size.y if vertical else child.cur_size.x) + gap
+        self._offsets = offsets
 
-            for child in self.children[:-1]:
-                child.resize(child_size)
-            self.children[-1].resize(last_child_size)
+    def _index(self):
+        if self._offsets is None or len(self._offsets) != len(self.children):
+            self.build_index()
+        return self._offsets
+
+    def navigate(self, command, pos: Point) -> bool:
+        """
+        Called with navigation commands like Command.UP while the cursor is inside this element.
+        Elements that scroll can consume the command instead of moving the cursor,
+        subclasses that only consume some commands list them in navigation_commands.
+        :param command: The navigation command
+        :param pos: The position of the cursor relative to this element
+        :return: True if the command was consumed
+        """
+        return False
 
     def action(self, event):
-        if self.event_handler:
-            self.event_handler(self, event)
-        else:
-            child = self.child_at(event.pos)
-            if child:
-                event.pos -= self.pos_of_child(child)
-                child.action(event)
+        elem = self
+        x, y = event.pos
+        # descend to the outermost element with a handler, event.pos is only made relative to it at the end
+        while not elem.event_handler:
+            i = elem._child_index_at(x, y)
+            if i is None:
+                return
+            inset = elem.inset
+            if elem.direction == 'vertical':
+                x -= inset
+                y -= elem._offsets[i] + inset
+            else:
+                x -= elem._offsets[i] + inset
+                y -= inset
+            elem = elem.children[i]
+        if elem is not self:
+            event.pos = Point(x, y)
+            elem.action(event)
+            return
+        result = self.event_handler(self, event)
+        if inspect.isawaitable(result):
+            (self.controller or controller).spawn(result, lambda _: self.invalidate())
+        self.invalidate()
 
     def separator(self):
         if self.separator_char:
@@ -369,37 +1263,25 @@ class Element:
         :return:
         """
         x, y = pos
-        if x >= self.cur_size.x or y >= self.cur_size.y:
+        i = self._child_index_at(x, y)
+        return None if i is None else self.children[i]
+
+    def _child_index_at(self, x: int, y: int):
+        """Returns the index of the child at the coordinates relative to this element, see child_at"""
+        if x >= self.cur_size[0] or y >= self.cur_size[1]:
             raise Exception("Specified coordinates are outside of this element.")
-        if len(self.children) == 0:
+        if not self.children:
             return None
-        if self.direction == 'vertical':
-            # find which child must write row
-            start_of_child = 0
-            for child in self.children:
-                row_after_child = start_of_child + child.cur_size.y
-                if y < row_after_child:
-                    return child
-                if self.separate:
-                    if y == row_after_child and child is not self.children[-1]:
-                        return None
-                    else:
-                        start_of_child = row_after_child + 1
-                else:
-                    start_of_child = row_after_child
-            return self.children[-1]
-        else:
-            children_sum = 0
-            for child in self.children:
-                if x < children_sum + child.cur_size.x:
-                    return child
-                if self.separate:
-                    if x == children_sum + child.cur_size.x and child is not self.children[-1]:
-                        return None
-                    else:
-                        children_sum += 1
-                children_sum += child.cur_size.x
-            return self.children[-1]
+        offsets = self._index()
+        vertical = self.direction == 'vertical'
+        coord = y if vertical else x
+        i = bisect_right(offsets, coord) - 1
+        if i == len(offsets) - 1:
+            return i
+        if coord < offsets[i] + self.children[i].cur_size[1 if vertical else 0]:
+            return i
+        # coordinate is on the separator after the child
+        return None
 
     def element_at(self, pos: Point):
         """
@@ -409,12 +1291,20 @@ class Element:
         :param pos: The position relative to this element
         :return: The deepest element at the position
         """
-        child = self.child_at(pos)
-        if child:
-            child_pos = self.pos_of_child(child)
-            return child.element_at(pos - child_pos)
-        else:
-            return self
+        elem = self
+        x, y = pos
+        while True:
+            i = elem._child_index_at(x, y)
+            if i is None:
+                return elem
+            inset = elem.inset
+            if elem.direction == 'vertical':
+                x -= inset
+                y -= elem._offsets[i] + inset
+            else:
+                x -= elem._offsets[i] + inset
+                y -= inset
+            elem = elem.children[i]
 
     def with_id(self, id_str: str):
         self.id = id_str
@@ -426,50 +1316,262 @@ class Element:
         :param child: The child of which the position should be returned
         :return:
         """
+        offsets = self._index()
         if isinstance(child, int):
-            child = self.children[child]
-        elif child not in self.children:
-            raise Exception("Asked for position of an element that is not a child of this element")
-        pos = 0
-        for c in self.children:
-            if c is child:
-                if self.direction == 'vertical':
-                    return Point(0, pos)
-                else:
-                    return Point(pos, 0)
-            pos += c.cur_size.y if self.direction == 'vertical' else c.cur_size.x
-            if self.separate:
-                pos += 1
+            i = child
+        else:
+            i = self.index_of_child(child)
+            if i is None:
+                raise Exception("Asked for position of an element that is not a child of this element")
+        inset = self.inset
+        if self.direction == 'vertical':
+            return Point(inset, offsets[i] + inset)
+        else:
+            return Point(offsets[i] + inset, inset)
 
     def with_child(self, child):
-        self.children.append(child)
-        self.min_size += child.min_size
-        child.parent = self
+        self.insert_child(len(self.children), child)
         return self
 
-    def with_content(self, content, update: bool = False):
+    def insert_child(self, index: int, child):
+        """
+        Inserts a child before the child at the index, like list.insert.
+        If this element already has a size, its children are laid out again.
+        """
+        if self.children is _NO_CHILDREN:
+            self.children = []
+        child_index = self._indices()
+        children = self.children
+        if index < 0:
+            index += len(children)
+        index = max(0, min(index, len(children)))
+        children.insert(index, child)
+        for i in range(index, len(children)):
+            child_index[children[i]] = i
+        self._adopt(child)
+        if child.min_size != ORIGIN:
+            self._update_min_size()
+        self._children_changed()
+
+    def remove_child(self, child):
+        """Removes the child, the remaining children are laid out again"""
+        child_index = self._indices()
+        index = child_index.pop(child, None)
+        if index is None:
+            raise Exception("given child is not a child of this parent")
+        children = self.children
+        del children[index]
+        for i in range(index, len(children)):
+            child_index[children[i]] = i
+        child.parent = None
+        if child.min_size != ORIGIN:
+            self._update_min_size()
+        self._children_changed()
+
+    def replace_child(self, old, new):
+        """Puts the new element in the place of the child old, the other children keep their layout"""
+        child_index = self._indices()
+        index = child_index.pop(old, None)
+        if index is None:
+            raise Exception("given child is not a child of this parent")
+        self.children[index] = new
+        child_index[new] = index
+        old.parent = None
+        self._adopt(new)
+        if new.min_size != old.min_size:
+            self._update_min_size()
+        if old.cur_size != ORIGIN:
+            new.resize(old.cur_size)
+
+    def move_child(self, child, index: int):
+        """Moves the child to the index, the children are laid out again"""
+        child_index = self._indices()
+        old_index = child_index.get(child)
+        if old_index is None:
+            raise Exception("given child is not a child of this parent")
+        children = self.children
+        del children[old_index]
+        if index < 0:
+            index += len(children) + 1
+        index = max(0, min(index, len(children)))
+        children.insert(index, child)
+        for i in range(min(index, old_index), max(index, old_index) + 1):
+            child_index[children[i]] = i
+        self._children_changed()
+
+    def _children_changed(self):
+        """Lays out the children again after children were inserted, removed or moved"""
+        self._offsets = None
+        self.invalidate_layout()
+        self.invalidate_render()
+        if self.cur_size != ORIGIN:
+            self.resize(self.cur_size)
+
+    def _combined_min_size(self) -> Point:
+        """
+        Returns the min_size this element needs for itself and its children: the sum of the min_size
+        of the children along the direction and their largest min_size across it, at least the own min size
+        """
+        own = self._own_min_size
+        if not self.children:
+            return own
+        along = 1 if self.direction == 'vertical' else 0
+        sizes = [child.min_size for child in self.children]
+        combined = [0, 0]
+        combined[along] = sum(size[along] for size in sizes)
+        combined[1 - along] = max(size[1 - along] for size in sizes)
+        return Point(max(own[0], combined[0]), max(own[1], combined[1]))
+
+    def _update_min_size(self):
+        """
+        Computes min_size again after the own min size or the min_size of a child changed.
+        Ancestors whose min_size changes with it are updated as well,
+        and the parent of each changed element lays out its children again.
+        """
+        changed_parents = []
+        elem = self
+        while elem is not None:
+            min_size = elem._combined_min_size()
+            if min_size == elem.min_size:
+                break
+            elem.min_size = min_size
+            if elem.parent is not None:
+                changed_parents.append(elem.parent)
+            elem = elem.parent
+        # from the top, so each element is laid out in the size its parent gives it
+        for parent in reversed(changed_parents):
+            parent._children_changed()
+
+    def _adopt(self, child):
+        """Makes this element the parent of a child that was added to the children"""
+        child.parent = self
+        self.invalidate_layout()
+        self.invalidate_render()
+        if child._dirty or child._dirty_below:
+            child._mark_ancestors_dirty()
+        if child._uncacheable or type(child).get_content is not Element.get_content:
+            elem = self
+            while elem is not None:
+                elem._uncacheable = True
+                elem = elem.parent
+
+    def with_content(self, content, update: bool = False, background: bool = False,
+                     timeout: float = None, stale_marker: str = None, max_pending: int = 1):
         """
         Sets the content of this element.
         :param content: Either the content itself or a function or other
-        callable that takes no arguments and returns the content
+        callable that takes this element and returns the content.
+        The function may also be a coroutine function, see async_loop
         :param update: If True, self.update() will be called after setting the content
+        :param background: If True, the content function runs on a thread pool
+        and the element keeps showing its last content until the result is available.
+        If a background or coroutine content function raises, the last content is kept and marked as stale
+        :param timeout: Seconds after which a running fetch makes the content stale
+        :param stale_marker: Shown at the end of the first row while the content is stale
+        :param max_pending: How many fetches of this element may run at the same time
         :return: This element
         """
+        self.background = background
+        self.fetch_timeout = timeout
+        self.stale_marker = stale_marker
+        self.max_pending = max_pending
+        if isinstance(self.content, VersionedList):
+            self.content.observers.discard(self)
+        was_polled = self.polled
         if callable(content):
             self.fetch_content = content
+            self.static_content = ''
+            self.polled = True
         else:
-            self.fetch_content = lambda _: content
+            self.fetch_content = _static_content
+            self.static_content = content
+            self.polled = not isinstance(content, STATIC_CONTENT_TYPES)
+            if isinstance(content, VersionedList):
+                content.observers.add(self)
+        if self.polled != was_polled:
+            # the refresh schedule is built together with the ScreenMap
+            self.invalidate_layout()
+        self.invalidate()
         if update:
             self.update()
         return self
 
+    def with_style(self, style: Style = None, **attributes):
+        """
+        Sets how this element and its descendants without a style of their own are displayed,
+        e.g. with_style(fg='white', bg='blue', bold=True). See FrameBuffer.Style for the attributes.
+        :param style: The style, or None to take it from the attributes
+        :return: This element
+        """
+        self.style = STYLES.id_of(style or Style(**attributes))
+        # the styles of the cells are kept by the ScreenMap
+        self.invalidate_layout()
+        self.invalidate_render()
+        return self
+
+    def with_refresh(self, interval):
+        """
+        Sets when the content of this element is fetched again.
+        By default, elements whose content has to be polled are refreshed after user input
+        and every AUTO_REFRESH_INTERVAL milliseconds.
+        Elements can always be refreshed with invalidate().
+        :param interval: Milliseconds between refreshes, which are not refreshed after user input,
+        REFRESH_ON_EVENT to only refresh after user input, REFRESH_NEVER or None for the default
+        :return: This element
+        """
+        if interval not in (None, REFRESH_NEVER, REFRESH_ON_EVENT) and not (isinstance(interval, int) and interval > 0):
+            raise Exception("refresh interval must be a positive number of milliseconds, "
+                            "REFRESH_NEVER or REFRESH_ON_EVENT, not {}".format(interval))
+        self.refresh_interval = interval
+        # the refresh schedule is built together with the ScreenMap
+        self.invalidate_layout()
+        return self
+
+    def with_weight(self, weight: int):
+        """
+        Sets how much of the space of the parent this element gets compared to its siblings.
+        The default is 1, an element with weight 2 gets twice the space of an element with weight 1.
+        """
+        self.weight = weight
+        if self.parent is not None:
+            self.parent._children_changed()
+        return self
+
+    def with_min_size(self, width: int, height: int):
+        """
+        Sets the size that the layout gives this element at least, if there is enough space.
+        The min_size of an element with children is at least what its children need together.
+        """
+        self._own_min_size = Point(width, height)
+        self._update_min_size()
+        return self
+
+    def with_max_size(self, width: int = None, height: int = None):
+        """
+        Sets the size that the layout gives this element at most,
+        space that is left over goes to the siblings. None means unbounded.
+        Only the size along the direction of the parent is limited.
+        """
+        big = sys.maxsize
+        self.max_size = None if width is None and height is None else Point(
+            big if width is None else width, big if height is None else height)
+        if self.parent is not None:
+            self.parent._children_changed()
+        return self
+
     def with_direction(self, direction):
         if direction.lower().strip() not in ['horizontal', 'vertical']:
             raise Exception
         self.direction = direction
+        self._update_min_size()
         return self
 
     def with_handler(self, handler):
+        """
+        Sets the function that is called with this element and the event
+        when an event occurs inside this element.
+        The handler may also be a coroutine function, see async_loop
+        """
         self.event_handler = handler
         return self
 
@@ -477,38 +1579,98 @@ class Element:
         """
         return the contents of the specified row as a string s.
         s must not contain newlines or tabs and len(s) must equal cur_size.x
+        This renders the whole element, prefer render() when more than one row is needed.
         :param row: which row of content should be returned
         :return: the content of the row as a string as described
         """
+        return self.render()[row]
+
+    def render(self, size: Point = None) -> list:
+        """
+        Renders this element and its subtree exactly once.
+        Returns cur_size.y rows, each a string of length cur_size.x
+        that contains no newlines or tabs.
+        The rows are cached until the element is resized or its displayed content changes,
+        the returned list must not be modified.
+        :param size: If given and different from cur_size, the element is resized first
+        :return: The rows of this element
+        """
+        if size is not None and size != self.cur_size:
+            self.resize(size)
+        if self._rendered is None:
+            rows = self.render_rows() if Debug.profiler is None else profiled('render', self, self.render_rows)
+            if self._uncacheable:
+                return rows
+            self._rendered = rows
+        return self._rendered
+
+    def render_rows(self) -> list:
+        """Renders the rows of this element without using the cached rows"""
+        w, h = self.cur_size
+        if w <= 0 or h <= 0:
+            return [''] * max(0, h)
+
         if len(self.children) > 0:
             if self.direction == 'vertical':
-                # find which child must write row
-                start_of_child = 0
+                rows = []
+                separator_row = self.separator() * w
                 for child in self.children:
-                    row_after_child = start_of_child + child.cur_size.y
-                    if row < row_after_child:
-                        return child.get_content(row - start_of_child)
-                    if self.separate:
-                        if row == row_after_child and child is not self.children[-1]:
-                            return self.separator() * self.cur_size.x
-                        else:
-                            start_of_child = row_after_child + 1
-                    else:
-                        start_of_child = row_after_child
-                return " " * self.cur_size.x
+                    rows.extend(render_child(child))
+                    if self.separate and child is not self.children[-1]:
+                        rows.append(separator_row)
+                if len(rows) < h:
+                    rows.extend([self.empty_row()] * (h - len(rows)))
+                return rows[:h]
             else:
                 joiner = self.separator() if self.separate else ""
-                return joiner.join([child.get_content(row) for child in self.children])
+                blocks = [render_child(child) for child in self.children]
+                rows = [joiner.join(parts) for parts in zip(*blocks)]
+                if rows and len(rows[0]) < w:
+                    # the children are limited by their max_size and don't fill the width
+                    rows = [row.ljust(w) for row in rows]
+                return rows
 
         if self.content is None:
-            return "?" * self.cur_size.x
+            return ["?" * w] * h
 
-        if isinstance(self.content, list):
-            content_str = "\n".join([str(c) for c in self.content])
+        flown = self.flown_content(w)[:h]
+        if len(flown) < h:
+            flown.extend([self.empty_row()] * (h - len(flown)))
+        if self._stale and self.stale_marker:
+            marker = self.stale_marker[:w]
+            flown[0] = flown[0][:w - len(marker)] + marker
+        return flown
+
+    def flown_content(self, width: int) -> list:
+        """
+        Returns the content of this element flowed to the given width.
+        The result is cached until the content or the width changes.
+        A VersionedList is compared by identity and version, any other
+        content by its string value.
+        :param width: The width to flow the content to
+        :return: The flowed lines, which must not be modified
+        """
+        content = self.content
+        key = self._flow_key
+        if isinstance(content, VersionedList):
+            if key is not None and key[0] is content and key[1] == content.version and key[2] == width:
+                return self._flown
+            new_key = (content, content.version, width)
+            content_str = "\n".join([str(c) for c in content])
         else:
-            content_str = str(self.content)
-        flown = flow_text(content_str, self.cur_size.x)
-        return flown[row] if row < len(flown) else self.empty_row()
+            if isinstance(content, list):
+                content_str = "\n".join([str(c) for c in content])
+            else:
+                content_str = str(content)
+            if key is not None and key[2] == width and key[1] is None and key[0] == content_str:
+                return self._flown
+            new_key = (content_str, None, width)
+        self._flow_key = new_key
+        if Debug.profiler is None:
+            self._flown = flow_text(content_str, width)
+        else:
+            self._flown = profiled('flow', self, flow_text, content_str, width)
+        return self._flown
 
     def empty_row(self):
         return " " * self.cur_size.x
@@ -517,65 +1679,480 @@ class Element:
         return Border(self, border_char)
 
 
+# the styles of a ScreenMap in which no element has a style
+_NO_STYLES = array('H')
+
+
+class ScreenMap:
+    """
+    Maps every cell of a root to the deepest element at that cell,
+    so that hit tests are a single array lookup.
+    It is built from the layout of the root and must be rebuilt when the layout changes.
+    """
+
+    @staticmethod
+    def of(root):
+        """Returns the ScreenMap of the root, it is rebuilt if the layout changed"""
+        screen_map = root._screen_map
+        if screen_map is None or screen_map.size != root.cur_size:
+            screen_map = root._screen_map = ScreenMap(root)
+        return screen_map
+
+    def __init__(self, root):
+        self.size = root.cur_size
+        self.width, self.height = self.size
+        # all elements of the tree, the cells hold indices into this list
+        self.elements = []
+        self.index = {}
+        self.origins = []
+        self.cells = array('i', [0]) * (max(0, self.width) * max(0, self.height))
+        # the elements are listed in focus order, ends holds the index after the descendants of each element
+        self.ends = array('i')
+        self._paint(root, 0, 0)
+        # the navigation commands that any element may consume, see Element.navigation_commands
+        self.navigated = frozenset().union(*map(_navigation_commands, {type(elem) for elem in self.elements}))
+        self._styles = None
+        # the rendered rows, width and height of the last frame and the frame, see frame
+        self._frame = None
+
+    def _paint(self, elem, x, y):
+        idx = len(self.elements)
+        self.elements.append(elem)
+        self.index[elem] = idx
+        self.origins.append(Point(x, y))
+        self.ends.append(0)
+        w = min(elem.cur_size.x, self.width - x)
+        h = min(elem.cur_size.y, self.height - y)
+        if w > 0 and h > 0:
+            row = array('i', [idx]) * w
+            for r in range(y * self.width + x, (y + h) * self.width + x, self.width):
+                self.cells[r:r + w] = row
+        for i, child in enumerate(elem.children):
+            offset = elem.pos_of_child(i)
+            self._paint(child, x + offset.x, y + offset.y)
+        self.ends[idx] = len(self.elements)
+
+    def styles(self):
+        """
+        Returns the style id of each cell, see Element.with_style.
+        Elements without a style have the style of their parent.
+        :return: An array of style ids or None if no element has a style
+        """
+        if self._styles is None:
+            elements = self.elements
+            if all(elem.style is None for elem in elements):
+                self._styles = _NO_STYLES
+                return None
+            elem_styles = array('H', [0]) * len(elements)
+            # parents come before their children
+            for i, elem in enumerate(elements):
+                if elem.style is not None:
+                    elem_styles[i] = elem.style
+                elif elem.parent is not None and elem.parent in self.index:
+                    elem_styles[i] = elem_styles[self.index[elem.parent]]
+            self._styles = array('H', map(elem_styles.__getitem__, self.cells))
+        elif self._styles is _NO_STYLES:
+            return None
+        return self._styles
+
+    def frame(self, rows: list, width: int, height: int) -> FrameBuffer:
+        """
+        Returns the frame showing the rendered rows of the root with the styles of this map.
+        The frame is kept until the root is rendered again, so controllers
+        drawing the same root with the same size get the same frame.
+        """
+        cached = self._frame
+        if cached is not None and cached[0] is rows and cached[1] == width and cached[2] == height:
+            return cached[3]
+        frame = FrameBuffer.from_rows(rows[:height], width, self.styles() if self.width == width else None)
+        self._frame = (rows, width, height, frame)
+        return frame
+
+    def element_at(self, pos: Point):
+        """Returns the deepest element at the absolute position or None if it is outside of the root"""
+        x, y = pos
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        return self.elements[self.cells[y * self.width + x]]
+
+    def position_of(self, elem) -> Point:
+        """Returns the absolute position of the element or None if it is not part of the root"""
+        idx = self.index.get(elem)
+        return None if idx is None else self.origins[idx]
+
+    def element_after(self, elem):
+        """
+        Returns the element after the element and its descendants in focus order,
+        the root after the last element, or None if the element is not part of the root
+        """
+        idx = self.index.get(elem)
+        if idx is None:
+            return None
+        end = self.ends[idx]
+        return self.elements[end] if end < len(self.elements) else self.elements[0]
+
+
+class ListView(Element):
+    """
+    Displays the items of a sequence, one item per row.
+    Only the visible items are materialized, so the cost of drawing depends
+    on the height of the element and not on the number of items.
+    The source may be any object that supports len() and indexing.
+    Moving the cursor beyond the first or last row scrolls,
+    Command.PAGE_UP/PAGE_DOWN jump by a page, Command.HOME jumps to the start
+    and Command.END follows the tail of the source.
+    """
+
+    __slots__ = ('source', 'offset', 'follow')
+    navigation_commands = frozenset({Command.UP, Command.DOWN, Command.PAGE_UP, Command.PAGE_DOWN,
+                                     Command.HOME, Command.END})
+
+    def __init__(self, source=None):
+        super(ListView, self).__init__()
+        self.source = source if source is not None else []
+        self.offset = 0
+        self.follow = False
+        # the visible items may change without notice
+        self.polled = True
+
+    def with_source(self, source):
+        self.source = source
+        self.invalidate_render()
+        return self
+
+    def with_follow(self, follow: bool = True):
+        """If follow is set, the last items of the source are shown, even when it grows"""
+        self.follow = follow
+        self.invalidate_render()
+        return self
+
+    def first_visible(self) -> int:
+        max_offset = max(0, len(self.source) - self.cur_size.y)
+        if self.follow:
+            return max_offset
+        return min(self.offset, max_offset)
+
+    def scroll_to(self, offset: int) -> bool:
+        """
+        Shows the items from the given index on.
+        :return: False if the view did not move
+        """
+        old = self.first_visible()
+        max_offset = max(0, len(self.source) - self.cur_size.y)
+        if self.follow and offset >= max_offset:
+            # already at the end, keeps following
+            return False
+        self.follow = False
+        self.offset = max(0, min(offset, max_offset))
+        if self.offset == old:
+            return False
+        self.invalidate_render()
+        return True
+
+    def navigate(self, command, pos: Point) -> bool:
+        h = self.cur_size.y
+        if command == Command.UP and pos.y == 0:
+            return self.scroll_to(self.first_visible() - 1)
+        if command == Command.DOWN and pos.y == h - 1:
+            return self.scroll_to(self.first_visible() + 1)
+        if command == Command.PAGE_UP:
+            self.scroll_to(self.first_visible() - h)
+            return True
+        if command == Command.PAGE_DOWN:
+            self.scroll_to(self.first_visible() + h)
+            return True
+        if command == Command.HOME:
+            self.scroll_to(0)
+            return True
+        if command == Command.END:
+            self.with_follow()
+            return True
+        return False
+
+    def refetch(self):
+        # only the visible rows are compared, so this costs as much as drawing
+        rows = self.render_rows()
+        if rows != self._rendered:
+            self.invalidate_render()
+            self._rendered = rows
+
+    def render_rows(self) -> list:
+        w, h = self.cur_size
+        if w <= 0 or h <= 0:
+            return [''] * max(0, h)
+        source = self.source
+        start = self.first_visible()
+        end = min(len(source), start + h)
+        rows = []
+        for i in range(start, end):
+            line = str(source[i]).expandtabs(tabsize=2).replace('\r', ' ').replace('\n', ' ')
+            rows.append(line[:w].ljust(w))
+        if len(rows) < h:
+            rows.extend([self.empty_row()] * (h - len(rows)))
+        return rows
+
+
+class TailView(ListView):
+    """
+    Shows the end of a text file, e.g. a log, and follows it while lines are appended.
+    The file is read through a LogFile, so only the lines that are shown are read and decoded
+    and scrolling only indexes the lines it passes. Command.HOME indexes the first lines of the file
+    and leaves the lines between them and the end unindexed until scrolling reaches them.
+    A truncated or rotated file is read from its start again.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, path: str, encoding: str = 'utf-8'):
+        super(TailView, self).__init__(LogFile(path, encoding))
+        self.follow = True
+
+    def _keep_shown_lines(self, index) -> int:
+        """Calls index, which indexes lines before the last lines, and keeps showing the same lines"""
+        first = self.first_visible()
+        gap = self.source.gap()
+        added = index()
+        if added and not self.follow and (gap is None or first >= gap):
+            self.offset = first + added
+        return added
+
+    def _index_backwards(self, n: int = None) -> int:
+        """Indexes n more lines before the last indexed lines, all up to the first lines if n is None"""
+        return self._keep_shown_lines(lambda: self.source.index_backwards(n))
+
+    def _index_head(self, n: int) -> int:
+        """Indexes n more lines after the first lines of the file"""
+        return self._keep_shown_lines(lambda: self.source.index_head(n))
+
+    def scroll_to(self, offset: int) -> bool:
+        gap = self.source.gap()
+        h = self.cur_size.y
+        if gap is None:
+            if offset < 0:
+                offset += self._index_backwards(max(-offset, INDEX_CHUNK))
+        elif self.first_visible() >= gap:
+            if offset < gap:
+                # up from the last lines into the gap, offset counts from the shown lines
+                offset += self._index_backwards(max(gap - offset, INDEX_CHUNK))
+        elif offset + h > gap:
+            # down from the first lines into the gap
+            self._index_head(max(offset + h - gap, INDEX_CHUNK))
+        return super(TailView, self).scroll_to(offset)
+
+    def navigate(self, command, pos: Point) -> bool:
+        if command == Command.HOME:
+            self._index_head(max(self.cur_size.y, INDEX_CHUNK))
+            super(TailView, self).scroll_to(0)
+            return True
+        return super(TailView, self).navigate(command, pos)
+
+    def refetch(self):
+        source = self.source
+        source.update()
+        missing = self.cur_size.y - len(source)
+        if missing > 0:
+            # e.g. the file was replaced by a file with longer lines
+            self._index_backwards(missing)
+        super(TailView, self).refetch()
+
+
+def _input_text(elem):
+    # the GapBuffer itself, Input only renders the part that is shown
+    return elem.text
+
+
 class Input(Element):
+    """
+    Editable text.
+    The text is kept in a GapBuffer and edited at the position of the cursor:
+    typed and pasted text is inserted where the cursor is and the cursor moves along.
+    Home and End move the cursor to the start and the end of the line.
+    Only the part of the text that fills the rows is rendered and searched,
+    so a keystroke takes as long in a long text as in a short one.
+    """
+
+    __slots__ = ('text', '_caret_pos')
+    navigation_commands = frozenset({Command.HOME, Command.END})
+
     def __init__(self):
         super(Input, self).__init__()
-        self.buffer = ''
-        super(Input, self).with_content(lambda _: self.buffer, True)
+        self.text = GapBuffer()
+        # where this element last placed the cursor, relative to this element
+        self._caret_pos = None
+        self._show_text()
         self.event_handler = self.default_handler
 
+    def _show_text(self):
+        super(Input, self).with_content(_input_text, True)
+        # the text only changes through the handler or the buffer setter, which invalidate
+        self.polled = False
+
+    @property
+    def buffer(self) -> str:
+        return str(self.text)
+
+    @buffer.setter
+    def buffer(self, value):
+        self.text.set_text(str(value))
+        self._caret_pos = None
+        self.invalidate()
+
     def default_handler(self, _, event):
-        if event.key == Command.DELETE_BEFORE:
-            self.buffer = self.buffer[:-1]
-        elif not isinstance(event.key, Command):
-            self.buffer += event.key
+        key = event.key
+        if not isinstance(key, str) and key not in (Command.DELETE_BEFORE, Command.DELETE):
+            return
+        self._move_point_to(event.pos)
+        if key == Command.DELETE_BEFORE:
+            self.text.delete_before()
+        elif key == Command.DELETE:
+            self.text.delete_after()
+        else:
+            # a single character or a whole Paste
+            self.text.insert(key)
+        self._place_cursor()
+
+    def navigate(self, command, pos: Point) -> bool:
+        if command not in (Command.HOME, Command.END):
+            return False
+        self._move_point_to(pos)
+        text = self.text
+        if command == Command.HOME:
+            text.move_to(text.rfind('\n', text.point) + 1)
+        else:
+            end_of_line = text.find('\n', text.point)
+            text.move_to(len(text) if end_of_line < 0 else end_of_line)
+        self._place_cursor()
+        return True
+
+    def _move_point_to(self, pos: Point):
+        if pos != self._caret_pos:
+            self.text.move_to(self.index_at(pos))
+
+    def _place_cursor(self):
+        """Moves the cursor of the controller to the insertion point"""
+        pos = self.position_of(self.text.point)
+        self._caret_pos = pos
+        ctl = self.controller or controller
+        origin = ctl.screen_map().position_of(self)
+        if origin is not None and pos.y < self.cur_size.y:
+            ctl.state.cursor = origin + pos
+
+    def _shown_text(self) -> str:
+        """Returns the start of the text that fills the rows of this element, a row shows at most its width and a newline"""
+        w, h = self.cur_size
+        return self.text.slice(0, (max(1, w) + 1) * max(0, h))
+
+    def show_content(self, value):
+        # the content is the buffer itself, flowing all of it would take as long as the text
+        self.content = value
+        self.invalidate_render()
+
+    def render_rows(self) -> list:
+        w, h = self.cur_size
+        if w <= 0 or h <= 0:
+            return [''] * max(0, h)
+        rows = flow_text(self._shown_text(), w)[:h]
+        if len(rows) < h:
+            rows.extend([self.empty_row()] * (h - len(rows)))
+        return rows
+
+    def index_at(self, pos: Point) -> int:
+        """Returns the index in the text that is shown at the position relative to this element"""
+        text = self._shown_text()
+        w = max(1, self.cur_size.x)
+        row = 0
+        start = 0
+        for line in text.split('\n'):
+            rows = max(1, -(-len(line) // w))
+            if pos.y < row + rows:
+                return start + min(len(line), (pos.y - row) * w + pos.x)
+            row += rows
+            start += len(line) + 1
+        return len(text)
+
+    def position_of(self, index: int) -> Point:
+        """
+        Returns the position relative to this element where the index of the text is shown,
+        a position below this element if the index is further down than its rows
+        """
+        text = self._shown_text()
+        if index > len(text):
+            return Point(0, self.cur_size.y)
+        w = max(1, self.cur_size.x)
+        line_start = text.rfind('\n', 0, index) + 1
+        row = sum(max(1, -(-len(line) // w)) for line in text[:line_start].split('\n')[:-1])
+        col = index - line_start
+        return Point(col % w, row + col // w)
 
     def with_content(self, content, update: bool = True):
         super(Input, self).with_content(content, True)
         self.buffer = self.content
-        super(Input, self).with_content(lambda _: self.buffer, True)
+        self._show_text()
         return self
 
 
-
 class Border(Element):
     """must always have exactly one child and no content"""
 
+    __slots__ = ('border',)
+    inset = 1
+
     def __init__(self, elem, border_char='#'):
         super(Border, self).__init__()
         self.children = [elem]
+        self._adopt(elem)
         self.border = border_char
         self.direction = elem.direction
-        self.min_size = elem.min_size + 2
+        self.min_size = self._combined_min_size()
         self.halign = elem.halign
         self.valign = elem.valign
 
+    def _combined_min_size(self) -> Point:
+        own = self._own_min_size
+        inner = self.children[0].min_size + 2
+        return Point(max(own[0], inner[0]), max(own[1], inner[1]))
+
+    def _child_index_at(self, x: int, y: int):
+        w, h = self.cur_size
+        if 0 < x < w - 1 and 0 < y < h - 1:
+            self._index()
+            return 0
+        # on the border
+        return None
+
     def add_child(self, child):
         self.children[0].add_child(child)
 
     def set_child(self, child):
-        self.children[0] = child
-
-    def resize(self, w, h):
-        self.cur_size = Point(w, h)
-        self.children[0].resize(w - 2, h - 2)
+        self.replace_child(self.children[0], child)
+        child.invalidate()
 
-    def get_content(self, row):
-        if row == 0 or row == self.cur_size.y - 1:
-            # first and last rows are border
-            return self.border * self.cur_size.x
-        else:
-            return self.border + self.children[0].get_content(row - 1) + self.border
+    def resize(self, size: Point):
+        self.cur_size = size
+        self.invalidate_render()
+        if self.children[0].cur_size != size - 2:
+            self.children[0].resize(size - 2)
+
+    def render_rows(self) -> list:
+        w, h = self.cur_size
+        if w <= 0 or h <= 0:
+            return [''] * max(0, h)
+        # first and last rows are border
+        edge = self.border * w
+        if h == 1:
+            return [edge]
+        inner = [self.border + row + self.border for row in render_child(self.children[0])]
+        return [edge] + inner + [edge]
 
 
 @unique
 class EventKind(Enum):
-    UNKNOWN = auto()
-    USER_INPUT = auto()
-
     def _generate_next_value_(name, start, count, last_values):
         return name
 
+    UNKNOWN = auto()
+    USER_INPUT = auto()
+
 
 class Event:
     def __init__(self, kind: EventKind = EventKind.UNKNOWN):
@@ -593,6 +2170,65 @@ class Event:
 class Debug:
     recent_inputs_raw = DroppingList(6)
     recent_inputs = DroppingList(12)
+    # seconds from reading an input until the frame showing its effect was written
+    input_latency = Histogram()
+    # seconds spent handling each input, e.g. in event handlers
+    input_handling = Histogram()
+    # the latest exceptions raised by content functions running in the background or asynchronously
+    fetch_errors = DroppingList(6)
+    # set to a Profiler to record the time spent per frame and per element, see ProfilerView
+    profiler: Profiler = None
+
+
+def profile_name(elem) -> str:
+    """The name under which the profiler records the element"""
+    return elem.id or '{}@{:x}'.format(type(elem).__name__, id(elem))
+
+
+def profiled(category: str, name, fn, *args):
+    """
+    Calls fn with the given arguments and records the call with Debug.profiler, if it is set.
+    :param name: The name of the span or the element it belongs to
+    """
+    prof = Debug.profiler
+    if prof is None:
+        return fn(*args)
+    prof.begin(category, name if isinstance(name, str) else profile_name(name))
+    try:
+        return fn(*args)
+    finally:
+        prof.end()
+
+
+class ProfilerView(Element):
+    """
+    Shows the average duration of the phases of a frame and the slowest elements
+    recorded by Debug.profiler. Profiling is enabled with Debug.profiler = Profiler().
+    """
+
+    __slots__ = ('top',)
+
+    def __init__(self, top: int = 5):
+        super(ProfilerView, self).__init__()
+        self.top = top
+        self.with_content(lambda elem: elem.profile_lines())
+
+    def with_top(self, top: int):
+        self.top = top
+        return self
+
+    def profile_lines(self) -> list:
+        prof = Debug.profiler
+        if prof is None:
+            return ['profiling disabled']
+        phases = prof.phase_averages()
+        lines = ['frame {} (ms): '.format(prof.frame)
+                 + ' '.join('{} {:.2f}'.format(name, seconds * 1000) for name, seconds in phases.items()),
+                 'slowest elements (ms per frame):']
+        for name, seconds, times in prof.top(self.top):
+            lines.append('{:.2f} {} ('.format(seconds * 1000, name)
+                         + ' '.join('{} {:.2f}'.format(category, t * 1000) for category, t in times.items()) + ')')
+        return lines
 
 
 def debug_info(elem):
@@ -602,24 +2238,21 @@ def debug_info(elem):
         state.properties['frame'] = 0
     return ['this element: {}'.format(elem),
             'absolute cursor position: {}'.format(state.cursor),
-            'elem under cursor: {}'.format(root.element_at(state.cursor)),
+            'elem under cursor: {}'.format(controller.element_under_cursor()),
             'first child under cursor: {}'.format(root.child_at(state.cursor)),
             'frame: {}'.format(state.properties['frame']),
             'raw in: {}'.format(Debug.recent_inputs_raw),
-            'parsed in: {}'.format(Debug.recent_inputs)]
+            'parsed in: {}'.format(Debug.recent_inputs),
+            'input latency: {}'.format(Debug.input_latency),
+            'input handling: {}'.format(Debug.input_handling)]
 
 
 def getch(timeout_millis: int = 0) -> bytes:
-    if timeout_millis <= 0:
-        return msvcrt.getch()
-
-    start_time = time.perf_counter()
-    while not (msvcrt.kbhit() or (time.perf_counter() - start_time) * 1000 > timeout_millis):
-        time.sleep(0.001)
-    if msvcrt.kbhit():
-        return msvcrt.getch()
-    else:
-        return None
+    """
+    Waits for user input using the input backend of the controller.
+    :return: All available input or None if there was none before the timeout
+    """
+    return controller.get_input_backend().read(timeout_millis)
 
 
 class TerminationRequestedException(Exception):
@@ -634,26 +2267,103 @@ def set_root(root):
 
 
 def draw(root=None):
+    """Draws the root once and leaves the terminal as it was, with the prompt below the frame"""
     if root:
         controller.active_root = root
     controller.update()
     root = controller.active_root
-    do_draw(root, controller.state)
+    try:
+        do_draw(root, controller.state)
+    finally:
+        # the next draw only writes what changed
+        controller.renderer.suspend()
 
 
 def loop(root=None):
     if root:
         controller.active_root = root
-    while True:
-        controller.update()
-        root = controller.active_root
-        do_draw(root, controller.state)
-        user_input = getch(AUTO_REFRESH_INTERVAL)
-        if user_input:
+    backend = controller.get_input_backend()
+    try:
+        with backend:
+            while True:
+                frame_wait = controller.next_frame()
+                user_input = backend.read(controller.wait_millis(frame_wait))
+                read_time = time.perf_counter()
+                if user_input:
+                    # handle everything that arrived in the meantime before drawing again
+                    more = backend.read_available()
+                    while more:
+                        user_input += more
+                        more = backend.read_available()
+                if user_input or controller.input_parser.pending():
+                    try:
+                        controller.process_user_input(user_input or b'', read_time)
+                    except TerminationRequestedException:
+                        break
+                controller.refresh_if_due()
+    finally:
+        controller.renderer.close()
+
+
+async def async_loop(root=None):
+    """
+    Runs the main loop as a coroutine on the running asyncio event loop.
+    Input is watched by the event loop instead of blocking it.
+    Content functions and handlers may be coroutine functions,
+    they run as tasks so slow content does not stall the frame.
+    Elements keep showing their previous content until their task has completed.
+    """
+    if root:
+        controller.active_root = root
+    event_loop = asyncio.get_running_loop()
+    backend = controller.get_input_backend()
+    wakeup = asyncio.Event()
+    inputs = deque()
+
+    def on_input(data):
+        if data:
+            inputs.append((data, time.perf_counter()))
+        wakeup.set()
+
+    async def read_in_executor():
+        # for backends that cannot be watched by the event loop
+        while True:
+            on_input(await event_loop.run_in_executor(None, backend.read, 100))
+
+    controller.event_loop = event_loop
+    controller.redraw_event = wakeup
+    reader = None
+    try:
+        with backend:
+            if not backend.attach(event_loop, on_input):
+                reader = event_loop.create_task(read_in_executor())
             try:
-                controller.process_user_input(user_input)
-            except TerminationRequestedException:
-                break
+                while True:
+                    frame_wait = controller.next_frame()
+                    timeout_millis = controller.wait_millis(frame_wait)
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), timeout_millis / 1000 if timeout_millis > 0 else None)
+                    except asyncio.TimeoutError:
+                        pass
+                    wakeup.clear()
+                    try:
+                        if inputs or controller.input_parser.pending():
+                            # handle everything that arrived in the meantime before drawing again
+                            while inputs:
+                                controller.receive_input(*inputs.popleft())
+                            controller.process_user_input()
+                    except TerminationRequestedException:
+                        break
+                    controller.refresh_if_due()
+            finally:
+                if reader:
+                    reader.cancel()
+                else:
+                    backend.detach(event_loop)
+    finally:
+        controller.event_loop = None
+        controller.redraw_event = None
+        controller.renderer.close()
 
 
 def main():